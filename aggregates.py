@@ -0,0 +1,393 @@
+import copy
+
+import numpy as np
+import pandas as pd
+
+
+## PRECOMPUTED AGGREGATES
+# Structures built once from df_final at startup so the callbacks can answer
+# slider/dropdown queries without re-grouping the full frame on every request.
+
+
+class EmissionsCube:
+    """Per-(Gas, Country) cumulative sums and counts indexed by Year.
+
+    The mean of any column over an inclusive [start, end] year range is two
+    prefix-sum lookups per country. Rows and ordering match
+    ``df[(Gas==gas) & (Year>=start) & (Year<=end)].groupby(['CountryName','CountryCode']).mean()``
+    and values are the correctly rounded means, i.e. equal to the groupby up
+    to the last bit of its summation order.
+
+    New years are added with ``append``, which extends the prefix sums from
+    their last column instead of rebuilding them.
+    """
+
+    def __init__(self, df, value_columns=('allsectors',)):
+        self.value_columns = list(value_columns)
+        self.countries = pd.DataFrame({'CountryName': pd.Series(dtype=object), 'CountryCode': pd.Series(dtype=object)})
+        self.first_year = None
+        self.last_year = None
+        self.gases = {}
+        self.append(df)
+
+    def copy(self):
+        """A cube that ``append`` can extend without changing this one; the prefix arrays are shared, never written."""
+        cube = copy.copy(self)
+        cube.gases = dict(self.gases)
+        return cube
+
+    def _empty_prefix(self, n_countries, n_columns):
+        prefix = {'__rows__': np.zeros((n_countries, n_columns), dtype=np.int64)}
+        for col in self.value_columns:
+            # Extended precision keeps the prefix differences exact to the
+            # last float64 bit, so range means equal the groupby result.
+            prefix[col] = (np.zeros((n_countries, n_columns), dtype=np.longdouble),
+                           np.zeros((n_countries, n_columns), dtype=np.int64))
+        return prefix
+
+    @staticmethod
+    def _map_prefix(prefix, func):
+        return {key: tuple(func(a) for a in value) if isinstance(value, tuple) else func(value)
+                for key, value in prefix.items()}
+
+    @staticmethod
+    def _extend(prefix, grid):
+        # Accumulating from the last prefix column gives the same additions,
+        # in the same order, as a cumsum over all years at once.
+        tail = np.cumsum(np.concatenate([prefix[:, -1:], grid.astype(prefix.dtype)], axis=1), axis=1)
+        return np.concatenate([prefix, tail[:, 1:]], axis=1)
+
+    def _add_countries(self, df):
+        countries = pd.concat([self.countries, df[['CountryName', 'CountryCode']].astype(object)]).drop_duplicates()
+        if len(countries) == len(self.countries):
+            return
+        countries = countries.sort_values(['CountryName', 'CountryCode']).reset_index(drop=True)
+        positions = pd.MultiIndex.from_frame(countries).get_indexer(pd.MultiIndex.from_frame(self.countries))
+
+        def move(a):
+            out = np.zeros((len(countries), a.shape[1]), dtype=a.dtype)
+            out[positions] = a
+            return out
+
+        for gas, prefix in self.gases.items():
+            self.gases[gas] = self._map_prefix(prefix, move)
+        self.countries = countries
+
+    def append(self, df):
+        """Add rows for years after ``last_year`` (and any new countries) to the cube.
+
+        The prefix sums are extended from their last column, so a cube built
+        in several appends holds the same arrays as one built from all the
+        rows at once.
+        """
+        df = df.dropna(subset=['Gas', 'CountryName', 'CountryCode', 'Year'])
+        if df.empty:
+            return
+        years = df['Year'].to_numpy().astype(np.int64)
+        if self.last_year is not None and years.min() <= self.last_year:
+            raise ValueError(f"EmissionsCube.append only takes years after {self.last_year}, got {years.min()}")
+
+        self._add_countries(df)
+        if self.first_year is None:
+            self.first_year = int(years.min())
+            self.last_year = self.first_year - 1
+        start_year = self.last_year + 1
+        n_years = int(years.max()) - start_year + 1
+        n_countries = len(self.countries)
+        n_columns = start_year - self.first_year + 1
+        country_index = pd.MultiIndex.from_frame(self.countries)
+        size = n_countries * n_years
+
+        gas_values = df['Gas'].astype(object).to_numpy()
+        gases = {}
+        for gas in sorted(set(self.gases) | set(gas_values)):
+            prefix = self.gases.get(gas) or self._empty_prefix(n_countries, n_columns)
+            gas_df = df[gas_values == gas]
+            rows = country_index.get_indexer(pd.MultiIndex.from_frame(gas_df[['CountryName', 'CountryCode']].astype(object)))
+            cells = rows * n_years + (gas_df['Year'].to_numpy().astype(np.int64) - start_year)
+
+            extended = {'__rows__': self._extend(prefix['__rows__'],
+                                                 np.bincount(cells, minlength=size).reshape(n_countries, n_years))}
+            for col in self.value_columns:
+                values = gas_df[col].to_numpy(dtype=np.float64)
+                valid = ~np.isnan(values)
+                sums = np.bincount(cells[valid], weights=values[valid], minlength=size)
+                counts = np.bincount(cells[valid], minlength=size)
+                extended[col] = (self._extend(prefix[col][0], sums.astype(np.longdouble).reshape(n_countries, n_years)),
+                                 self._extend(prefix[col][1], counts.reshape(n_countries, n_years)))
+            gases[gas] = extended
+        self.gases = gases
+        self.last_year = start_year + n_years - 1
+
+    def _bounds(self, start, end):
+        if self.first_year is None:
+            return 0, 0
+        start = self.first_year if start is None else int(start)
+        end = self.last_year if end is None else int(end)
+        lo = max(start, self.first_year) - self.first_year
+        hi = min(end, self.last_year) - self.first_year + 1
+        return lo, hi
+
+    def range_mean(self, gas, start, end, columns=None):
+        """Return CountryName, CountryCode and the mean of each of ``columns`` (default all) for ``gas`` in [start, end]."""
+        columns = self.value_columns if columns is None else columns
+        prefix = self.gases.get(gas)
+        lo, hi = self._bounds(start, end)
+        if prefix is None or lo >= hi:
+            out = self.countries.iloc[:0].copy()
+            for col in columns:
+                out[col] = np.array([], dtype=np.float64)
+            return out
+
+        rows = prefix['__rows__']
+        present = (rows[:, hi] - rows[:, lo]) > 0
+        out = self.countries[present].reset_index(drop=True)
+        for col in columns:
+            sums, counts = prefix[col]
+            total = (sums[present, hi] - sums[present, lo]).astype(np.float64)
+            n = counts[present, hi] - counts[present, lo]
+            with np.errstate(invalid='ignore', divide='ignore'):
+                out[col] = np.where(n > 0, total / np.maximum(n, 1), np.nan)
+        return out
+
+    def _sums(self, gas, column):
+        # gas=None adds up every gas, as a groupby without a Gas filter would
+        if gas is None:
+            return sum((prefix[column][0] for prefix in self.gases.values()), start=np.longdouble(0))
+        prefix = self.gases.get(gas)
+        return None if prefix is None else prefix[column][0]
+
+    def range_sum(self, gas, column, start=None, end=None):
+        """Per-country sum of ``column`` for ``gas`` in [start, end], aligned with ``countries``."""
+        sums = self._sums(gas, column)
+        lo, hi = self._bounds(start, end)
+        if sums is None or lo >= hi or not self.gases:
+            return np.zeros(len(self.countries))
+        return (sums[:, hi] - sums[:, lo]).astype(np.float64)
+
+    def range_rows(self, gas, start=None, end=None):
+        """Per-country number of rows for ``gas`` in [start, end], aligned with ``countries``."""
+        prefix = self.gases.get(gas)
+        lo, hi = self._bounds(start, end)
+        if prefix is None or lo >= hi:
+            return np.zeros(len(self.countries), dtype=np.int64)
+        return prefix['__rows__'][:, hi] - prefix['__rows__'][:, lo]
+
+    def yearly(self, gas, column, end=None):
+        """(years, per-country sums of ``column`` for every year up to ``end``) for ``gas``."""
+        _, hi = self._bounds(None, end)
+        years = np.arange(self.first_year, self.first_year + hi) if self.first_year is not None else np.arange(0)
+        sums = self._sums(gas, column)
+        if sums is None or not self.gases:
+            return years, np.zeros((len(self.countries), len(years)))
+        return years, np.diff(sums[:, :hi + 1], axis=1).astype(np.float64)
+
+    def yearly_counts(self, gas, column, end=None):
+        """(rows, non-NaN values of ``column``) per country and year up to ``end`` for ``gas``; None adds up every gas."""
+        if gas is None and self.gases:
+            counts = [self.yearly_counts(g, column, end) for g in self.gases]
+            return sum(rows for rows, _ in counts), sum(values for _, values in counts)
+        _, hi = self._bounds(None, end)
+        prefix = self.gases.get(gas)
+        if prefix is None:
+            empty = np.zeros((len(self.countries), hi), dtype=np.int64)
+            return empty, empty
+        return np.diff(prefix['__rows__'][:, :hi + 1], axis=1), np.diff(prefix[column][1][:, :hi + 1], axis=1)
+
+    def top_n(self, n, gas='GHG', column='allsectors', start=None, end=None):
+        """CountryName of the ``n`` largest emitters of ``gas`` over [start, end], largest first.
+
+        Countries without rows for ``gas`` in the range are not ranked.
+        """
+        present = np.flatnonzero(self.range_rows(gas, start, end) > 0)
+        totals = self.range_sum(gas, column, start, end)[present]
+        n = min(n, len(totals))
+        if n == 0:
+            return []
+        candidates = np.argpartition(-totals, n - 1)[:n]
+        order = present[candidates[np.argsort(-totals[candidates], kind='stable')]]
+        return self.countries['CountryName'].to_numpy()[order].tolist()
+
+
+class SeriesIndex:
+    """Rows of a frame sorted by ``keys`` then Year, with the row bounds of every key.
+
+    Each key's rows are one contiguous slice of ``frame`` and its years are
+    found by binary search, so a lookup costs O(log rows) however large the
+    table grows.
+    """
+
+    def __init__(self, df, keys, year='Year'):
+        self.keys = list(keys)
+        self.frame = df.sort_values(self.keys + [year], kind='stable', ignore_index=True)
+        self.years = self.frame[year].to_numpy()
+        n = len(self.frame)
+        if n == 0:
+            self.bounds = {}
+            return
+        changed = np.zeros(n - 1, dtype=bool)
+        for key in self.keys:
+            codes = pd.factorize(self.frame[key])[0]
+            changed |= codes[1:] != codes[:-1]
+        starts = np.concatenate([[0], np.flatnonzero(changed) + 1])
+        stops = np.append(starts[1:], n)
+        labels = zip(*(self.frame[key].to_numpy()[starts] for key in self.keys))
+        # one key indexes by its value, several by a tuple
+        self.bounds = {(label if len(self.keys) > 1 else label[0]): (start, stop)
+                       for label, start, stop in zip(labels, starts.tolist(), stops.tolist())}
+
+    def rows(self, key, start=None, end=None):
+        """Slice of ``frame`` holding ``key`` with start <= Year <= end."""
+        lo, hi = self.bounds.get(key, (0, 0))
+        years = self.years[lo:hi]
+        first = lo if start is None else lo + int(np.searchsorted(years, start, 'left'))
+        last = hi if end is None else lo + int(np.searchsorted(years, end, 'right'))
+        return slice(first, max(first, last))
+
+
+SECTOR_ID_COLUMNS = ['Region', 'CountryName', 'CountryCode', 'Year', 'Gas', 'predicted']
+SECTOR_EXCLUDED_COLUMNS = ['LUCF', 'allsectors']
+
+
+class RollupStore:
+    """World -> Region -> Country -> Gas -> Sector totals over any year range.
+
+    Every (gas, country) leaf keeps prefix sums over years of each column (an
+    EmissionsCube), so the totals of a year range are two lookups per leaf and
+    figures built from them carry one node per displayed total instead of
+    re-aggregating the rows.
+
+    ``actual`` answers for the historical rows only, queried with
+    ``end=actual_end``. Predicted rows come after the last historical year,
+    so that is the same cube cut at that year; only when the two share years
+    does it get a cube of its own.
+
+    When new data only adds later years, ``extended`` appends them to the
+    prefix sums of the previous store instead of rebuilding every leaf.
+    """
+
+    def __init__(self, df, columns):
+        self.columns = list(columns)
+        self.cube = EmissionsCube(df, value_columns=self.columns)
+        self._index(df)
+
+    def _index(self, df, actual=None):
+        # ``actual`` is the historical cube extended by ``extended``, used when it cannot be the shared one
+        codes = self.cube.countries['CountryCode']
+        regions = df.drop_duplicates('CountryCode').set_index('CountryCode')['Region'].astype(object)
+        self.regions = regions.reindex(codes).to_numpy()
+        self.positions = {code: i for i, code in enumerate(codes)}
+
+        predicted = df['predicted'].to_numpy(dtype=bool)
+        years = df['Year'].to_numpy()
+        self.actual_end = int(years[~predicted].max()) if (~predicted).any() else None
+        if self.actual_end is not None and not (predicted.any() and years[predicted].min() <= self.actual_end):
+            self.actual = self.cube
+        elif actual is not None:
+            self.actual = actual
+        else:
+            self.actual = EmissionsCube(df[~predicted], value_columns=self.columns)
+
+    def extended(self, df, rows):
+        """Store for ``df``, which is this store's rows plus ``rows`` of years after ``cube.last_year``.
+
+        The prefix sums are extended from copies of this store's, which stays
+        as it was for whoever still reads it.
+        """
+        store = copy.copy(self)
+        store.cube = self.cube.copy()
+        store.cube.append(rows)
+        actual = None
+        if self.actual is not self.cube:
+            actual = self.actual.copy()
+            actual.append(rows[~rows['predicted'].to_numpy(dtype=bool)])
+        store._index(df, actual)
+        return store
+
+    def actual_totals(self, columns, value='Emissions'):
+        """CountryName and the sum of ``columns`` over every gas of the historical rows, per country that has any."""
+        actual = self.actual
+        rows = sum((actual.range_rows(gas, end=self.actual_end) for gas in actual.gases),
+                   start=np.zeros(len(actual.countries), dtype=np.int64))
+        totals = sum((actual.range_sum(None, col, end=self.actual_end) for col in columns),
+                     start=np.zeros(len(actual.countries)))
+        present = rows > 0
+        return pd.DataFrame({'CountryName': actual.countries['CountryName'].to_numpy()[present],
+                             value: totals[present]})
+
+    def leaves(self, columns, gases=None, country_codes=None, start=None, end=None, value='Emissions'):
+        """Region, CountryName, CountryCode, Gas, Sector and ``value`` of every leaf with rows in [start, end].
+
+        ``gases`` and ``country_codes`` default to all of them; leaves are
+        listed by gas, then by column (one Sector each), then by country in
+        the order given.
+        """
+        gases = list(self.cube.gases) if gases is None else [gas for gas in gases if gas in self.cube.gases]
+        if country_codes is None:
+            rows = np.arange(len(self.cube.countries))
+        else:
+            rows = np.array([self.positions[code] for code in dict.fromkeys(country_codes) if code in self.positions],
+                            dtype=np.int64)
+        names = self.cube.countries['CountryName'].to_numpy()
+        codes = self.cube.countries['CountryCode'].to_numpy()
+
+        parts = []
+        for gas in gases:
+            present = rows[self.cube.range_rows(gas, start, end)[rows] > 0]
+            for column in columns:
+                parts.append(pd.DataFrame({
+                    'Region': self.regions[present], 'CountryName': names[present], 'CountryCode': codes[present],
+                    'Gas': gas, 'Sector': column, value: self.cube.range_sum(gas, column, start, end)[present]}))
+        if not parts:
+            return pd.DataFrame(columns=['Region', 'CountryName', 'CountryCode', 'Gas', 'Sector', value])
+        return pd.concat(parts, ignore_index=True)
+
+
+def appended_rows(previous, df):
+    """Rows of ``df`` for years after the last one of ``previous``, or None unless the rest of ``df`` is ``previous``.
+
+    The rest must hold the same columns, dtypes and values in the same order,
+    as a snapshot of ``previous`` with new years added to it does.
+    """
+    if list(df.columns) != list(previous.columns) or previous.empty:
+        return None
+    later = df['Year'].to_numpy() > previous['Year'].max()
+    rest = df[~later]
+    if len(rest) != len(previous):
+        return None
+    for col in df.columns:
+        a, b = rest[col].reset_index(drop=True), previous[col].reset_index(drop=True)
+        if a.dtype.name == 'category' and b.dtype.name == 'category':
+            # categories may have grown with the new rows
+            a, b = a.astype(object), b.astype(object)
+        if not a.equals(b):
+            return None
+    return df[later]
+
+
+def hierarchy(df, path, value, root=None):
+    """(ids, labels, parents, values) of every node of ``path`` for a treemap or sunburst with branchvalues='total'.
+
+    Leaves are summed per full path and each level above is summed from the
+    one below it, so a parent always equals the total of its children. Ids
+    join the path with '/', under ``root`` when one is given.
+    """
+    prefix = [root] if root is not None else []
+    levels = [df.groupby(path, sort=False, observed=True)[value].sum()]
+    for depth in range(len(path) - 1, 0, -1):
+        levels.insert(0, levels[0].groupby(level=list(range(depth)), sort=False).sum())
+
+    ids, labels, parents, values = [], [], [], []
+    if root is not None:
+        ids.append(root)
+        labels.append(root)
+        parents.append('')
+        values.append(float(levels[0].sum()))
+    for level in levels:
+        for key, total in zip(level.index, level.to_numpy().tolist()):
+            key = [str(part) for part in (key if isinstance(key, tuple) else (key,))]
+            ids.append('/'.join(prefix + key))
+            labels.append(key[-1])
+            parents.append('/'.join(prefix + key[:-1]))
+            values.append(total)
+    return ids, labels, parents, values
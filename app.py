@@ -1,14 +1,25 @@
-from dash import Dash, dcc, html, Input, Output, State
+from dash import Dash, dcc, html, Input, Output, State, ClientsideFunction
+from flask import Response, request, stream_with_context
+import os
+import re
+from functools import partial
 import plotly.express as px
-import pandas as pd
-from raceplotly.plots import barplot
 import plotly.graph_objects as go
 import dash_bootstrap_components as dbc
 from plotly.subplots import make_subplots
 import numpy as np
 import dash_daq as daq
-import boto3
-import os
+
+from aggregates import SECTOR_EXCLUDED_COLUMNS, SECTOR_ID_COLUMNS, RollupStore, SeriesIndex, appended_rows, hierarchy
+from carbon_footprint import FIELDS, BulkInputError, gauge_value, score_households, stream_scores
+from clientside import CLIENTSIDE_MODE, emissions_store, line_series_store
+from data_loader import DataRefresher, data_version, get_snapshot_dir
+from figure_cache import FigureCache
+from forecast import forecast_config, forecast_enabled, with_forecast
+from metrics import profiler
+from payload import PAYLOAD_BUDGET, cap_nodes, collapse_small, payload_config, payload_stats, round_significant
+from raceplot import RACEPLOT_TOP_N, item_colors, race_config, race_figure, race_frames
+from static_figures import FIGURE_WORKERS, StaticFigureStore, precompute, remove_stale_artifacts
 
 
 external_stylesheets = [
@@ -21,49 +32,87 @@ app = Dash(__name__,external_stylesheets=external_stylesheets)
 
 server = app.server
 
+# Memoized outputs of the data callbacks, keyed on the live data version and the payload settings; see figure_cache.py for the backends
+figure_cache = FigureCache.from_env(data_version=lambda: data.state.version, config=payload_config())
 
-## READ DATA
-
-df_final = ""
-df_countries = ""
-AWS_KEY = os.environ['AWS_ACCESS_KEY']
-AWS_SECRET_KEY = os.environ['AWS_SECRET_KEY']
-client = boto3.client('s3',aws_access_key_id=AWS_KEY,aws_secret_access_key=AWS_SECRET_KEY)
-response = client.get_object(Bucket='ghg-data-bucket', Key='df_final.csv')
-status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-
-
-if status == 200:
-    # print(f"Successful S3 get_object response. Status - {status}")
-    df_final = pd.read_csv(response.get("Body"))
-    # print(df)
-    print("reading done-df")
-else:
-    print(f"Unsuccessful S3 get_object response. Status - {status}")
-
-response = client.get_object(Bucket='ghg-data-bucket', Key='countries.csv')
-status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
-
-if status == 200:
-    # print(f"Successful S3 get_object response. Status - {status}")
-    df_countries = pd.read_csv(response.get("Body"))
-    # print(df)
-    print("reading done-countries")
-else:
-    print(f"Unsuccessful S3 get_object response. Status - {status}")
-
-
-# df_final = pd.read_csv("./df_final.csv")
-
-# df_countries = pd.read_csv("./countries.csv")
 
-#TODO: Make this Dynamic
-top_10_polluters = ['United States', 'China', 'Russian Federation', 'India', 'Japan', 'United Kingdom', 'Canada', 'Brazil', 'Germany', 'France']
+## READ DATA
+# Downloaded once per host into a memory-mapped snapshot, see data_loader.py.
+# Everything derived from the tables is built into one DataState; with
+# GHG_RELOAD_INTERVAL set, a new state is built in the background when the
+# source changes and swapped in whole. Callbacks read data.state once.
+
+class DataState:
+    """The tables, their indexes and figure stores for one data version.
+
+    ``previous`` is the state this one replaces, if any: when the new
+    df_final only adds years after it, its rollup is extended rather than
+    rebuilt.
+    """
+
+    def __init__(self, tables, manifests, previous=None):
+        self.version = data_version(manifests)
+        self.df_final = tables['df_final.csv']
+        self.df_countries = tables['countries.csv']
+        self.sector_columns = [col for col in self.df_final.columns if col not in SECTOR_ID_COLUMNS]
+
+        if forecast_enabled():
+            # Predicted rows refitted from this version's historical rows, see forecast.py
+            self.df_final = with_forecast(self.df_final, self.sector_columns)
+            self.version = f"{self.version}-{forecast_config()}"
+
+        # The snapshot keeps historical rows first, so this subset is a slice of df_final rather than a copy
+        self.df_actual = self.df_final.iloc[:int((~self.df_final['predicted']).sum())]
+
+        # Region -> Country -> Gas -> Sector totals over any year range, one set of prefix sums shared by the
+        # choropleth means, the treemap, the sector sunburst and the rankings of the historical years
+        self.sectors = [col for col in self.sector_columns if col not in SECTOR_EXCLUDED_COLUMNS]
+        rows = appended_rows(previous.df_final, self.df_final) if previous is not None else None
+        if rows is not None:
+            self.rollup = previous.rollup.extended(self.df_final, rows)
+            print(f"rollup extended with {len(rows)} rows after {previous.rollup.cube.last_year}", flush=True)
+        else:
+            self.rollup = RollupStore(self.df_final, self.sector_columns)
+        self.emissions_cube = self.rollup.cube
+
+        # Line chart rows, one contiguous slice per (country, gas, predicted) series
+        self.series_index = SeriesIndex(self.df_final[['CountryCode', 'CountryName', 'Gas', 'predicted', 'Year', 'allsectors']],
+                                        ['CountryCode', 'Gas', 'predicted'])
+
+        self.top_10_polluters = self.rollup.actual.top_n(10, gas='GHG', column='allsectors', end=self.rollup.actual_end)
+        self.race_colors = item_colors(len(self.rollup.actual.countries))
+        self.area_curve_text = area_curve_text(self)
+
+        # Built on first request (or loaded from an artifact) instead of with the state
+        self.static_figures = StaticFigureStore(
+            {
+                'area_graphs': partial(display_area_graphs, self),
+                'pie_chart_red_grey': partial(display_red_grey_pie_chart, self),
+            },
+            data_version=self.version,
+            artifact_dir=os.path.join(get_snapshot_dir(), 'figures'))
+
+        # One race per gas and sector, each built the first time it is picked
+        self.race_figures = StaticFigureStore(
+            {race_key(gas, sector): partial(display_raceplot, self, gas, sector)
+             for gas in GAS_FILTERS for sector in self.sector_columns},
+            data_version=f"{self.version}-{race_config()}",
+            artifact_dir=os.path.join(get_snapshot_dir(), 'figures'))
+
+        if FIGURE_WORKERS > 1:
+            # Figures the page shows first, built side by side before the state goes live
+            precompute([(self.static_figures, name) for name in self.static_figures.builders]
+                       + [(self.race_figures, race_key('all', 'allsectors'))])
+
+        self.clientside_stores = clientside_store_data(self) if CLIENTSIDE_MODE else {}
 
 #TODO: Add more dark colors
 all_colors = ['#1f77b4','#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
 np.random.shuffle(all_colors)
 
+# Line colors for any number of selected countries, starting with all_colors
+line_colors = all_colors + [c for c in px.colors.qualitative.Dark24 + px.colors.qualitative.Alphabet if c not in all_colors]
+
 
 
 
@@ -71,60 +120,87 @@ np.random.shuffle(all_colors)
 
 ## STATIC PLOTS
 
-def get_countries_options():
-    global df_countries
-    return list(df_countries.apply(lambda x: {"label": x[1],"value":x[0]},axis=1))
-
-def display_raceplot():
-    global df_final
-    df = df_final[df_final['predicted']=='No']
-    race_df = df.groupby(['CountryName','CountryCode','Year']).sum()
-    race_df.reset_index( drop=False, inplace=True )
-    race_df.reindex(['CountryName','CountryCode','Year','LUCF','agriculture','allsectors',
-        'electricity and heat production','energy','gaseous fuel consumption','liquid fuel consumption',
-        'manufacturing industries and construction','other sectors, excluding residential buildings and commercial and public services',
-        'residential buildings and commercial and public services','solid fuel consumption','transport'], axis=1)
-    my_raceplot = barplot(race_df,  item_column='CountryName', value_column='allsectors', time_column='Year')
-    fig = my_raceplot.plot(item_label = 'Top 10 countries', value_label = 'Emissions (tonnes)', frame_duration = 800)
-    fig.update_layout(height=700)
+def get_countries_options(state):
+    return list(state.df_countries.apply(lambda x: {"label": x[1],"value":x[0]},axis=1))
+
+# Gas options of the race and the treemap; 'all' adds up every Gas row
+GAS_FILTERS = ['all', 'Carbon dioxide(CO2)', 'Nitrous oxide(N2O)', 'methane(CH4)', 'GHG']
+
+def race_key(gas, sector):
+    return re.sub(r'[^A-Za-z0-9]+', '_', f"raceplot-{gas}-{sector}")
+
+@profiler.instrument('display_raceplot')
+def display_raceplot(state, gas='all', sector='allsectors'):
+    actual, end = state.rollup.actual, state.rollup.actual_end
+    with profiler.phase('data'):
+        # Top N of every year straight from the per-year totals of the historical rows
+        years, values = actual.yearly(None if gas == 'all' else gas, sector, end)
+        rows, _ = actual.yearly_counts(None if gas == 'all' else gas, sector, end)
+        frames = race_frames(years, values, rows > 0)
+    with profiler.phase('figure'):
+        fig = race_figure(frames, actual.countries['CountryName'], state.race_colors,
+                          item_label = f'Top {RACEPLOT_TOP_N} countries', value_label = 'Emissions (tonnes)', frame_duration = 800)
+        fig['layout']['height'] = 700
     return fig
 
-def display_red_grey_pie_chart():
-    global df_final
-    global top_10_polluters
-    df_copy = df_final[df_final['predicted']=='No'].copy()
-    df_copy.drop(['LUCF','allsectors','predicted'],axis=1,inplace=True)
-    df_pie = df_copy.melt(id_vars=['Region','CountryName','CountryCode','Year','Gas'], var_name='Sector', value_name='Emissions')
+@profiler.instrument('display_red_grey_pie_chart')
+def display_red_grey_pie_chart(state):
+    with profiler.phase('data'):
+        # Historical emissions of every sector but LUCF, per country
+        df_pie = state.rollup.actual_totals(state.sectors)
 
-    # top_10_polluters = df_pie.groupby(['CountryName','CountryCode']).sum().reset_index().nlargest(10,'Emissions')['CountryName'].tolist()
     colormap = {}
     for country in df_pie['CountryName'].unique().tolist():
       colormap[country] = 'grey'
-    for country in top_10_polluters:
+    for country in state.top_10_polluters:
       colormap[country] = 'red'
-    fig = px.sunburst(df_pie, path=['CountryName'], values='Emissions', color='CountryName',color_discrete_map=colormap, height=600, width=600)
+    with profiler.phase('figure'):
+        fig = px.sunburst(df_pie, path=['CountryName'], values='Emissions', color='CountryName',color_discrete_map=colormap, height=600, width=600)
     return fig
 
-def display_area_graphs():
-    global df_final
-    global top_10_polluters
+@profiler.instrument('display_area_graphs')
+def display_area_graphs(state):
+    df = state.df_actual
+    top_10_polluters = state.top_10_polluters
 
-    df = df_final[df_final['predicted']=='No'].copy()
+    with profiler.phase('data'):
+        # One grouping pass for all ten countries instead of a filter and groupby each
+        yearly = df[df['CountryName'].isin(top_10_polluters)].groupby(['CountryName','Year'], observed=True)['allsectors'].sum()
 
+    # Five to a row; a data set with fewer than ten countries gets fewer panels
     fig = make_subplots(
-        rows=2, cols=5,
+        rows=max((len(top_10_polluters) + 4) // 5, 1), cols=5,
         subplot_titles=(top_10_polluters))
-    count =0
-    for r in range(1,3):
-      for c in range(1,6):
-        # print(count,r,c)
-        tempdf = df[df['CountryName']==top_10_polluters[count]].groupby(['Year']).sum().reset_index()
-        X = tempdf['Year'].to_list()
-        Y = tempdf['allsectors'].to_list()
-        fig.add_trace(go.Scatter(x=X,y=Y,fill='tozeroy',showlegend=False),row=r,col=c)
-        count +=1
+    for count, country in enumerate(top_10_polluters):
+        with profiler.phase('data'):
+            tempdf = yearly.loc[country]
+            X = tempdf.index.to_list()
+            Y = tempdf.to_list()
+        with profiler.phase('figure'):
+            fig.add_trace(go.Scatter(x=X,y=Y,fill='tozeroy',showlegend=False),row=count // 5 + 1,col=count % 5 + 1)
     return fig
 
+def area_curve_text(state):
+    # Which of the ranked countries rise or fall, by the least squares slope of the totals the area graphs plot
+    if not state.top_10_polluters:
+        return ""
+    actual, end = state.rollup.actual, state.rollup.actual_end
+    years, totals = actual.yearly(None, 'allsectors', end)
+    rows, _ = actual.yearly_counts(None, 'allsectors', end)
+    positions = {name: i for i, name in reversed(list(enumerate(actual.countries['CountryName'])))}
+    falling = []
+    for country in state.top_10_polluters:
+        i = positions[country]
+        present = rows[i] > 0
+        if present.sum() >= 2 and np.polyfit(years[present], totals[i][present], 1)[0] < 0:
+            falling.append(country)
+    if not falling:
+        return "All the countries are showing an increasing trend."
+    if len(falling) == len(state.top_10_polluters):
+        return "All the countries are showing a decreasing trend."
+    names = falling[0] if len(falling) == 1 else f"{', '.join(falling[:-1])} and {falling[-1]}"
+    return f"All the countries are showing an increasing trend except {names}."
+
 def get_interesting_facts():
     facts = ["TWO THIRDS of the global emissions are just from the top 10 global emitters!",
     "Carbon Dioxide(CO2) is the most emitted greenhouse gas accounting for about 74 % of the total \
@@ -136,15 +212,34 @@ def get_interesting_facts():
 
     return [html.Li(fact,style={'font-size':20,'font-weight': 'bold','color': '#0E5D12'}) for fact in facts]
 
-def display_treemap():
-    global df_final
-    fig = px.treemap(df_final, path=[px.Constant("world"), 'Region', 'CountryName'], values='allsectors',
-                  color='Region', hover_data=['Region'],
-                  color_continuous_scale='RdBu',)
-                  
-    fig.update_layout(margin = dict(t=50, l=25, r=25, b=25))
+def static_graph(graph_id):
+    return dcc.Loading(dcc.Graph(id=graph_id, figure={}), type='circle')
+
+def choropleth_figure(df3):
+    fig = px.choropleth(df3, locations="CountryCode",
+                    color="allsectors", # encode colors according to allsectors column
+                    hover_name="CountryName", # column to add to hover information
+                    hover_data = {
+                        'CountryName':False,
+                        'allsectors': True,
+                        'CountryCode': False
+                    },
+                    color_continuous_scale='RdYlGn_r', width=1800, height=900)
+    fig.update_layout(clickmode='event+select')
     return fig
 
+def clientside_store_data(state):
+    # Aggregates behind the clientside choropleth, encoded once per data version
+    template = choropleth_figure(state.emissions_cube.range_mean('GHG', None, None, ['allsectors']))
+    return {'emissions_store': emissions_store(state.emissions_cube, template)}
+
+def get_clientside_stores(state):
+    # Aggregates behind the clientside choropleth and the line series it clips
+    if not CLIENTSIDE_MODE:
+        return []
+    return [dcc.Store(id='emissions_store', data=state.clientside_stores['emissions_store']),
+            dcc.Store(id='line_chart_series')]
+
 def get_marks():
     marks = {}
     for x in range(1960,2040,4):
@@ -152,11 +247,25 @@ def get_marks():
     return marks
 
 
+## LOAD DATA
+def remove_stale_figures(state):
+    # Artifacts of the versions before this one would only be read by a worker that has not reloaded yet
+    removed = remove_stale_artifacts([state.static_figures, state.race_figures])
+    if removed:
+        print(f"removed {removed} figure artifacts of other data versions")
+
+data = DataRefresher(['df_final.csv', 'countries.csv'], DataState, on_swap=remove_stale_figures)
+data.start()
+
+
 
 
 
 ## MAIN APP LAYOUT 
-app.layout = html.Div([
+# A function, so every page load gets the countries and stores of the live data version
+def serve_layout():
+    state = data.state
+    return html.Div([
     
      dbc.NavbarSimple(
         children=[
@@ -209,6 +318,7 @@ app.layout = html.Div([
                 ),
         ),
         dcc.Graph(id="choropleth_graph",figure={}),
+        html.Div(id='clientside_stores',children=get_clientside_stores(state)),
         dcc.RangeSlider(1960, 2040, 4, 
             id='year_range_slider',
             marks=get_marks(),
@@ -225,7 +335,7 @@ app.layout = html.Div([
         dbc.Row(
             [  
                 dbc.Col(dcc.Dropdown(id="slct_country",
-                             options=get_countries_options(),
+                             options=get_countries_options(state),
                              multi=True,
                              value=['USA','CHN','IND'],
                              ),
@@ -243,20 +353,56 @@ app.layout = html.Div([
         html.Br(),
         html.Br(),
         html.H2("An overview of top 10 polluter countries",id='top10overview'),
-        dcc.Graph(id="area_graphs",figure=display_area_graphs()),
-        html.P(id="area_curve_text",children="All the countries are showing an increasing trend except the top polluters of EU, i.e., United Kingdom, Germany, France.",style={'padding-left': '10px','color': '#0E5D12','font-size':20,'font-weight': 'bold'}),
+        static_graph("area_graphs"),
+        html.P(id="area_curve_text",children=state.area_curve_text,style={'padding-left': '10px','color': '#0E5D12','font-size':20,'font-weight': 'bold'}),
         html.H2("Racing Bar graph of Top 10 Countries",id="top10_race_plot"),
-        dcc.Graph(id="raceplot",figure=display_raceplot()),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Dropdown(id="slct_race_gas",
+                             options=[{"label": 'All gas rows' if gas == 'all' else gas, "value": gas} for gas in GAS_FILTERS],
+                             value='all',
+                             clearable=False,
+                             ),
+                        width={'size':3},
+                ),
+                dbc.Col(dcc.Dropdown(id="slct_race_sector",
+                             options=[{"label": sector, "value": sector} for sector in state.sector_columns],
+                             value='allsectors',
+                             clearable=False,
+                             ),
+                        width={'size':3},
+                ),
+            ],
+        ),
+        static_graph("raceplot"),
         html.Br(id='treemapbr'),
         html.Br(),
         html.Br(),
         html.H2('Treemap showing total emissions by regions',id="treemap_h3"),
-        dcc.Graph(id="treemap",figure=display_treemap()),
+        dbc.Row(
+            [
+                dbc.Col(dcc.Dropdown(id="slct_treemap_gas",
+                             options=[{"label": 'All gas rows' if gas == 'all' else gas, "value": gas} for gas in GAS_FILTERS],
+                             value='all',
+                             clearable=False,
+                             ),
+                        width={'size':3},
+                ),
+                dbc.Col(dcc.RangeSlider(1960, 2040, 4,
+                             id='treemap_year_range',
+                             marks=get_marks(),
+                             value=[1960, 2040],
+                             ),
+                        width={'size':9},
+                ),
+            ],
+        ),
+        static_graph("treemap"),
         html.Br(id='interesting_factsbr'),
         html.Br(),
         html.Br(),
         html.H2("Interesting Facts", id='interesting_facts'),
-        dbc.Row(dbc.Col(dcc.Graph(id="pie_chart_red_grey",figure=display_red_grey_pie_chart()),width={'size': 6, 'offset': 3},
+        dbc.Row(dbc.Col(static_graph("pie_chart_red_grey"),width={'size': 6, 'offset': 3},
             ),
         ),
         html.Ul(id="interesting_facts_list",children=get_interesting_facts()),
@@ -347,33 +493,70 @@ app.layout = html.Div([
     ])
 ])
 
+app.layout = serve_layout
+
 
 
 
 
 
 ## ALL CALLBACKS
-## Callback to update choropleth map according to gas selected
-@app.callback(
-    [Output("choropleth_graph", "figure"),Output("choropleth_text","children")], 
-    [Input("slct_gas", "value"),
-    Input("year_range_slider","value")])
+## Static figures are filled in once the page has loaded
+def static_figure_callback(graph_id):
+    @app.callback(Output(graph_id, "figure"), Input(graph_id, "id"))
+    @profiler.instrument(f'load_{graph_id}')
+    def load_static_figure(_):
+        return data.state.static_figures.get(graph_id)
+    return load_static_figure
+
+for graph_id in data.state.static_figures.builders:
+    static_figure_callback(graph_id)
+
+@app.callback(Output("raceplot", "figure"), [Input("slct_race_gas", "value"), Input("slct_race_sector", "value")])
+
+@profiler.instrument('load_raceplot')
+def load_raceplot(gas, sector):
+    return data.state.race_figures.get(race_key(gas, sector))
+
+## Callback to update the treemap for the gas and years selected
+@app.callback(Output("treemap", "figure"), [Input("slct_treemap_gas", "value"), Input("treemap_year_range", "value")])
+
+@profiler.instrument('display_treemap', measure_serialization=True)
+@figure_cache.memoize('display_treemap')
+def display_treemap(gas, year_range):
+    state = data.state
+    with profiler.phase('data'):
+        # Country totals of the range from the rollup; the figure only carries the displayed nodes
+        leaves = state.rollup.leaves(['allsectors'], None if gas == 'all' else [gas],
+                                     start=year_range[0], end=year_range[1], value='allsectors')
+        ids, labels, parents, values = hierarchy(leaves, ['Region', 'CountryName'], 'allsectors', root='world')
+        # colored by region as px does, the root mixes regions
+        regions = [node.split('/')[1] if '/' in node else '(?)' for node in ids]
+        palette = px.colors.qualitative.Plotly
+        region_colors = {region: palette[i % len(palette)] for i, region in enumerate(dict.fromkeys(regions))}
+
+    with profiler.phase('figure'):
+        fig = go.Figure(go.Treemap(ids=ids, labels=labels, parents=parents, values=values, branchvalues='total',
+                                   marker=dict(colors=[region_colors[region] for region in regions]),
+                                   customdata=regions,
+                                   hovertemplate='labels=%{label}<br>allsectors=%{value}<br>parent=%{parent}<br>id=%{id}<br>Region=%{customdata}<extra></extra>'))
+        fig.update_layout(margin = dict(t=50, l=25, r=25, b=25))
+    return fig
 
+## Callback to update choropleth map according to gas selected
+@profiler.instrument('display_choropleth', measure_serialization=True)
+@figure_cache.memoize('display_choropleth')
 def display_choropleth(gas_selected,year_range):
-    global df_final
-    
-    df3 = df_final[(df_final['Gas']==gas_selected)&(df_final['Year']>=year_range[0])&(df_final['Year']<=year_range[1])].groupby(['CountryName','CountryCode']).mean().reset_index()
+    state = data.state
 
-    fig = px.choropleth(df3, locations="CountryCode",
-                    color="allsectors", # encode colors according to allsectors column
-                    hover_name="CountryName", # column to add to hover information
-                    hover_data = {
-                        'CountryName':False,
-                        'allsectors': True,
-                        'CountryCode': False
-                    },
-                    color_continuous_scale='RdYlGn_r', width=1800, height=900)
-    fig.update_layout(clickmode='event+select')
+    with profiler.phase('data'):
+        df3 = state.emissions_cube.range_mean(gas_selected, year_range[0], year_range[1], ['allsectors'])
+
+    with profiler.phase('figure'):
+        fig = choropleth_figure(df3)
+        if PAYLOAD_BUDGET:
+            # the hover template only reads hovertext and z
+            fig.update_traces(z=round_significant(df3['allsectors']), customdata=None)
 
     highest_emitter_df = df3.nlargest(1,'allsectors')
     highest_country_name = "no country"
@@ -402,55 +585,97 @@ def display_choropleth(gas_selected,year_range):
     return fig, text
 
 
-## Callback to update Line graphs according to country and gas selected
-@app.callback(
-    Output("country_line_chart", "figure"),
-    [Input("slct_country", "value"),
-    Input("slct_gas","value"),
-    Input('choropleth_graph', 'selectedData'),
-    Input("year_range_slider","value")])
-
-def update_line_chart(countries_selected,gas_selected, selected_data,year_range):
-    global df_final
+def line_chart_series(state, countries_selected, gas_selected, selected_data, year_range=None):
+    """(name, years, values, line style) of every line, actual data first then predicted."""
+    series_index = state.series_index
     
     if(type(countries_selected)!=list):
         countries_selected = [countries_selected]
 
     
     if(selected_data != None):
-        for item in selected_data['points']:
-            countries_selected.append(item['location'])
-    
+        countries_selected = countries_selected + [item['location'] for item in selected_data['points']]
     
-    mask2 = (df_final['CountryCode'].isin(countries_selected)) & (df_final['Gas']==gas_selected) & (df_final['Year']>=year_range[0]) & (df_final['Year']<=year_range[1])
     
-    trimmed_df = df_final[mask2]
-    fig = go.Figure()
-    # line plots
-    actual_df = trimmed_df[trimmed_df['predicted']=='No']
-    if(actual_df.shape[0]>0):
-        for i in range(len(countries_selected)):
-            tempdf = actual_df[actual_df['CountryCode']==countries_selected[i]]
-            Y = tempdf['allsectors'].to_list()
-            X = tempdf['Year'].to_list()
-            country_name = tempdf['CountryName'].to_list()[0]
-            fig.add_trace(go.Scatter(x=X, y=Y, name=country_name,line=dict(color=all_colors[i])))
-
-    #dotted lines
-    predicted_df = trimmed_df[trimmed_df['predicted']=='Yes']
-    if(predicted_df.shape[0]>0):
-        for i in range(len(countries_selected)):
-            tempdf = predicted_df[predicted_df['CountryCode']==countries_selected[i]]
-            Y = tempdf['allsectors'].to_list()
-            X = tempdf['Year'].to_list()
-            country_name = tempdf['CountryName'].to_list()[0]
-            fig.add_trace(go.Scatter(x=X, y=Y, name=country_name,line=dict(color=all_colors[i],dash='dash')))
-
+    # Duplicates collapse to the first time a country was picked
+    countries_selected = list(dict.fromkeys(countries_selected))
+
+    start, end = year_range if year_range is not None else (None, None)
+    with profiler.phase('data'):
+        # Each series is a slice of the index, sorted by year; no pass over the whole frame
+        years = series_index.years
+        values = series_index.frame['allsectors'].to_numpy()
+        names = series_index.frame['CountryName']
+        rows = {(predicted, country): series_index.rows((country, gas_selected, predicted), start, end)
+                for predicted in (False, True) for country in countries_selected}
+
+    with profiler.phase('figure'):
+        series = []
+        # solid lines for actual data, dashed for predicted; countries without rows are skipped
+        for predicted, dash in ((False, None), (True, 'dash')):
+            for i, country in enumerate(countries_selected):
+                found = rows[(predicted, country)]
+                if found.stop == found.start:
+                    continue
+                line = dict(color=line_colors[i % len(line_colors)])
+                if dash is not None:
+                    line['dash'] = dash
+                series.append((names.iat[found.start], years[found], values[found], line))
+    return series
+
+def line_chart_layout(fig):
     fig.update_layout(height=600,width=1000)
-   
+    return fig
+
+## Callback to update Line graphs according to country and gas selected
+@profiler.instrument('update_line_chart', measure_serialization=True)
+@figure_cache.memoize('update_line_chart', keep_order=True)
+def update_line_chart(countries_selected,gas_selected, selected_data,year_range):
+    series = line_chart_series(data.state, countries_selected, gas_selected, selected_data, year_range)
+    with profiler.phase('figure'):
+        traces = [go.Scatter(x=x, y=y, name=name, line=line) for name, x, y, line in series]
+        fig = line_chart_layout(go.Figure(data=traces))
 
     return fig
 
+@profiler.instrument('update_line_series', measure_serialization=True)
+@figure_cache.memoize('update_line_series', keep_order=True)
+def update_line_series(countries_selected, selected_data):
+    # Every gas over all years; the browser picks the gas and clips to the slider
+    state = data.state
+    series = {gas: line_chart_series(state, countries_selected, gas, selected_data) for gas in state.emissions_cube.gases}
+    return line_series_store(series, line_chart_layout(go.Figure()).layout)
+
+## The choropleth and line chart are answered in the browser in CLIENTSIDE_MODE, see clientside.py
+if CLIENTSIDE_MODE:
+    app.clientside_callback(
+        ClientsideFunction(namespace='ghg', function_name='recolor_choropleth'),
+        [Output("choropleth_graph", "figure"),Output("choropleth_text","children")],
+        [Input("slct_gas", "value"),
+        Input("year_range_slider","value")],
+        State("emissions_store", "data"))
+    app.callback(
+        Output("line_chart_series", "data"),
+        [Input("slct_country", "value"),
+        Input('choropleth_graph', 'selectedData')])(update_line_series)
+    app.clientside_callback(
+        ClientsideFunction(namespace='ghg', function_name='clip_line_chart'),
+        Output("country_line_chart", "figure"),
+        [Input("line_chart_series", "data"),
+        Input("slct_gas","value"),
+        Input("year_range_slider","value")])
+else:
+    app.callback(
+        [Output("choropleth_graph", "figure"),Output("choropleth_text","children")], 
+        [Input("slct_gas", "value"),
+        Input("year_range_slider","value")])(display_choropleth)
+    app.callback(
+        Output("country_line_chart", "figure"),
+        [Input("slct_country", "value"),
+        Input("slct_gas","value"),
+        Input('choropleth_graph', 'selectedData'),
+        Input("year_range_slider","value")])(update_line_chart)
+
 
 # Callback to update Sunburst chart
 @app.callback(
@@ -459,13 +684,11 @@ def update_line_chart(countries_selected,gas_selected, selected_data,year_range)
     Input('choropleth_graph', 'selectedData'),
     Input("year_range_slider","value")])
 
+@profiler.instrument('update_sunburst_chart', measure_serialization=True)
+@figure_cache.memoize('update_sunburst_chart')
 def update_sunburst_chart(countries_selected,selected_data,year_range):
-    global df_final
-
-    df_copy = df_final.copy()
-    df_copy.drop(['LUCF','allsectors','predicted'],axis=1,inplace=True)
-    df_pie = df_copy.melt(id_vars=['Region','CountryName','CountryCode','Year','Gas'], var_name='Sector', value_name='Emissions')
-    # print("calling pie chart thing")
+    rollup = data.state.rollup
+    sectors = data.state.sectors
 
     if(type(countries_selected)!=list):
         countries_selected = [countries_selected]
@@ -475,16 +698,22 @@ def update_sunburst_chart(countries_selected,selected_data,year_range):
         for item in selected_data['points']:
             countries_selected.append(item['location'])
 
-    mask = df_pie['CountryCode'].isin(countries_selected) & (df_pie['Year']>=year_range[0]) & (df_pie['Year']<=year_range[1])
-    fig = px.sunburst(df_pie[mask], 
-                        path=['Region','CountryName', 'Gas', 'Sector'], 
-                        values='Emissions',
-                        color_continuous_scale=all_colors,#px.colors.sequential.algae,
-                        width=650, 
-                        height=650)
-    text = {'family':'Times New Roman','size':15,'color':'black'}
-    fig.update_traces(textinfo="label+percent root")
-    fig.update_layout(font=text)
+    with profiler.phase('data'):
+        path = ['Region','CountryName', 'Gas', 'Sector']
+        # Sector totals of the range from the rollup, one leaf per displayed node
+        df_pie = rollup.leaves(sectors, country_codes=countries_selected, start=year_range[0], end=year_range[1])
+        if PAYLOAD_BUDGET:
+            df_pie = collapse_small(df_pie, path, 'Emissions')
+            df_pie, path = cap_nodes(df_pie, path, 'Emissions')
+            df_pie['Emissions'] = round_significant(df_pie['Emissions'])
+        ids, labels, parents, values = hierarchy(df_pie, path, 'Emissions')
+    with profiler.phase('figure'):
+        fig = go.Figure(go.Sunburst(ids=ids, labels=labels, parents=parents, values=values, branchvalues='total',
+                                    hovertemplate='labels=%{label}<br>Emissions=%{value}<br>parent=%{parent}<br>id=%{id}<extra></extra>'))
+        fig.update_layout(width=650, height=650)
+        text = {'family':'Times New Roman','size':15,'color':'black'}
+        fig.update_traces(textinfo="label+percent root")
+        fig.update_layout(font=text)
     return fig
 
 
@@ -497,24 +726,83 @@ def update_sunburst_chart(countries_selected,selected_data,year_range):
     State('flights_short','value'),State('flights_long','value'),
     State('recycle_paper','value'),State('recycle_metal','value')])
 
+@profiler.instrument('calculate_carbon_footprint')
 def calculate_carbon_footprint(n_clicks,electricity_bill,gas_bill,oil_bill,mileage,flights_short,flights_long,recycle_paper,recycle_metal):
-    cp=0.0
     if(n_clicks>0):
-        cp += (electricity_bill+ gas_bill)*105 
-        cp+= oil_bill*113 
-        cp+= mileage*0.79 
-        cp+= flights_short*1100 
-        cp+= flights_long*4400
-
-        if(recycle_paper=='No'):
-            cp += 184
-        if(recycle_metal=='No'):
-            cp += 166
-        # print("cp: ",cp)
-        indicator = cp
-        if(cp>40000):
-            indicator = 40000
+        values = [electricity_bill,gas_bill,oil_bill,mileage,flights_short,flights_long,recycle_paper,recycle_metal]
+        footprint, _ = score_households({field: [value] for field, value in zip(FIELDS, values)})
+        cp = float(footprint[0])
+        indicator = float(gauge_value(footprint)[0])
         return "your carbon footprint is: "+str(cp) + " pounds per year",indicator
     return "Enter your values and press the button!",20000
 
+
+## Bulk scoring of survey responses, streamed back one row per line
+@server.route('/api/carbon-footprint', methods=['POST'])
+def carbon_footprint_bulk():
+    content_type = request.mimetype
+    mimetype = 'text/csv' if content_type == 'text/csv' else 'application/x-ndjson'
+    try:
+        lines, ignored = stream_scores(request.stream, content_type)
+    except BulkInputError as e:
+        return Response(f'{e}\n', status=400, mimetype='text/plain')
+    # columns that are not household fields are scored as absent, say which so a misspelt one shows up
+    headers = {'X-Ignored-Fields': ','.join(ignored)} if ignored else {}
+    return Response(stream_with_context(lines), mimetype=mimetype, headers=headers)
+
+## Prometheus metrics for this worker, and a runtime switch for profiling
+def app_metrics():
+    pid = os.getpid()
+    stats = figure_cache.stats()
+    lines = ['# HELP ghg_figure_cache_requests_total Figure cache lookups by result.',
+             '# TYPE ghg_figure_cache_requests_total counter',
+             f'ghg_figure_cache_requests_total{{result="hit",pid="{pid}"}} {stats["hits"]}',
+             f'ghg_figure_cache_requests_total{{result="miss",pid="{pid}"}} {stats["misses"]}',
+             '# HELP ghg_figure_payload_bytes Serialized size of the last figure returned by each callback.',
+             '# TYPE ghg_figure_payload_bytes gauge']
+    payloads = sorted(payload_stats.items())
+    for name, stat in payloads:
+        lines.append(f'ghg_figure_payload_bytes{{name="{name}",pid="{pid}"}} {stat["bytes"]}')
+    lines += ['# HELP ghg_figure_serialize_seconds JSON encode time of the last figure each callback built.',
+              '# TYPE ghg_figure_serialize_seconds gauge']
+    for name, stat in payloads:
+        lines.append(f'ghg_figure_serialize_seconds{{name="{name}",pid="{pid}"}} {stat["serialize_s"]}')
+    lines += ['# HELP ghg_figure_payloads_total Figures returned by each callback, built or from the cache.',
+              '# TYPE ghg_figure_payloads_total counter']
+    for name, stat in payloads:
+        lines.append(f'ghg_figure_payloads_total{{name="{name}",pid="{pid}"}} {stat["count"]}')
+    lines += ['# HELP ghg_data_reloads_total Data versions swapped in since the worker started.',
+              '# TYPE ghg_data_reloads_total counter',
+              f'ghg_data_reloads_total{{pid="{pid}"}} {data.reloads}',
+              '# HELP ghg_data_reload_failures_total Background data reloads that failed and kept the old version.',
+              '# TYPE ghg_data_reload_failures_total counter',
+              f'ghg_data_reload_failures_total{{pid="{pid}"}} {data.failures}',
+              '# HELP ghg_data_load_seconds Time of the last load of each data object, by phase.',
+              '# TYPE ghg_data_load_seconds gauge']
+    for key, timing in sorted(data.load_timings.items()):
+        for phase in ('fetch', 'parse', 'total'):
+            lines.append(f'ghg_data_load_seconds{{key="{key}",phase="{phase}",source="{timing["source"]}",pid="{pid}"}} {timing[phase + "_s"]}')
+    lines += ['# HELP ghg_static_figure_seconds Time to build or load each static figure.',
+              '# TYPE ghg_static_figure_seconds gauge']
+    state = data.state
+    for name, timing in sorted({**state.static_figures.timings, **state.race_figures.timings}.items()):
+        lines.append(f'ghg_static_figure_seconds{{name="{name}",source="{timing["source"]}",pid="{pid}"}} {timing["total_s"]}')
+    return lines
+
+profiler.add_collector(app_metrics)
+
+@server.route('/metrics')
+def metrics():
+    return Response(profiler.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+@server.route('/metrics/profiling', methods=['GET', 'POST'])
+def profiling_switch():
+    if request.method == 'POST':
+        token = os.environ.get('PROFILING_TOKEN')
+        if not token or request.headers.get('X-Profiling-Token') != token:
+            return Response('forbidden\n', status=403, mimetype='text/plain')
+        profiler.set_enabled(request.values.get('enabled', '1').lower() in ('1', 'true', 'yes', 'on'))
+    # the other workers pick the switch up from the flag file within FLAG_POLL_INTERVAL
+    return Response(f'profiling {"on" if profiler.enabled else "off"} in worker {os.getpid()}\n', mimetype='text/plain')
+
 # app.run_server(debug=True)
@@ -0,0 +1,168 @@
+// Clientside callbacks used when the app runs with CLIENTSIDE_MODE=1, see clientside.py.
+// The emissions store holds, per gas, yearly sums and counts of every country as
+// base64 typed arrays (country-major, n_years per country); rows is only sent
+// when it differs from counts.
+
+(function () {
+    var ARRAY_TYPES = {f8: Float64Array, f4: Float32Array, u1: Uint8Array, u2: Uint16Array, u4: Uint32Array};
+    var decoded = new WeakMap();
+
+    function decodeArray(encoded) {
+        var binary = atob(encoded.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new ARRAY_TYPES[encoded.dtype](bytes.buffer);
+    }
+
+    function gasArrays(store, gas) {
+        var cache = decoded.get(store);
+        if (!cache) {
+            cache = {};
+            decoded.set(store, cache);
+        }
+        if (!(gas in cache)) {
+            var encoded = store.gases[gas];
+            if (encoded) {
+                var counts = decodeArray(encoded.counts);
+                cache[gas] = {
+                    sums: decodeArray(encoded.sums),
+                    rows: encoded.rows ? decodeArray(encoded.rows) : counts,
+                    counts: counts
+                };
+            } else {
+                cache[gas] = null;
+            }
+        }
+        return cache[gas];
+    }
+
+    // np.format_float_positional(value, precision=3)
+    function formatPositional(value) {
+        if (isNaN(value)) {
+            return 'nan';
+        }
+        if (!isFinite(value)) {
+            return value > 0 ? 'inf' : '-inf';
+        }
+        // Shortest round-trip digits when they fit, otherwise rounded to 3
+        // decimals; like numpy, a round up drops the zeros its carry leaves.
+        var shortest = String(value);
+        if (shortest.indexOf('e') < 0) {
+            var parts = shortest.split('.');
+            if (parts.length < 2 || parts[1].length <= 3) {
+                return parts[0] + '.' + (parts[1] || '');
+            }
+        }
+        var fixed = value.toFixed(3);
+        return Math.abs(Number(fixed)) > Math.abs(value) ? fixed.replace(/0+$/, '') : fixed;
+    }
+
+    // Mean of every country with rows for gas in [start, end], like EmissionsCube.range_mean
+    function rangeMean(store, gas, start, end) {
+        var out = {codes: [], names: [], values: []};
+        var arrays = gasArrays(store, gas);
+        var nYears = store.n_years;
+        if (!arrays || store.first_year === null) {
+            return out;
+        }
+        var lo = Math.max(start, store.first_year) - store.first_year;
+        var hi = Math.min(end, store.first_year + nYears - 1) - store.first_year + 1;
+        if (lo >= hi) {
+            return out;
+        }
+        for (var c = 0; c < store.codes.length; c++) {
+            // Neumaier summation, so totals match the server's exact prefix differences
+            var rows = 0, n = 0, total = 0, compensation = 0;
+            for (var y = c * nYears + lo; y < c * nYears + hi; y++) {
+                rows += arrays.rows[y];
+                n += arrays.counts[y];
+                var value = arrays.sums[y], t = total + value;
+                compensation += Math.abs(total) >= Math.abs(value) ? (total - t) + value : (value - t) + total;
+                total = t;
+            }
+            total += compensation;
+            if (rows === 0) {
+                continue;
+            }
+            out.codes.push(store.codes[c]);
+            out.names.push(store.names[c]);
+            out.values.push(n > 0 ? total / n : NaN);
+        }
+        return out;
+    }
+
+    function summary(means, yearRange) {
+        var highest = -1, lowest = -1, total = 0, n = 0;
+        for (var i = 0; i < means.values.length; i++) {
+            var value = means.values[i];
+            if (isNaN(value)) {
+                continue;
+            }
+            if (highest < 0 || value > means.values[highest]) {
+                highest = i;
+            }
+            if (lowest < 0 || value < means.values[lowest]) {
+                lowest = i;
+            }
+            total += value;
+            n += 1;
+        }
+        var mean = n > 0 ? total / n : NaN;
+
+        var highestName = "no country", highestEmission = 0, percentageShare = 0;
+        if (highest >= 0) {
+            highestName = means.names[highest];
+            highestEmission = formatPositional(means.values[highest] / 1000000);
+            percentageShare = formatPositional(means.values[highest] / mean);
+        }
+        var lowestName = "no country", lowestEmission = 0;
+        if (lowest >= 0) {
+            lowestName = means.names[lowest];
+            lowestEmission = formatPositional(means.values[lowest]);
+        }
+
+        return ["Between year ", yearRange[0], " and ", yearRange[1], " the top polluter is ", highestName, ", with an average emission of ",
+            highestEmission, " Giga Ton CO2eq contributing to ", percentageShare, "%", " of the total emissions. On the other side, the least polluting country is ", lowestName, " and the average amount of gaseous emissions is ",
+            lowestEmission, " Kilo Ton CO2eq. On an average the value of emissions per country is ", formatPositional(mean / 1000000), " Giga Ton CO2eq."];
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        ghg: {
+            recolor_choropleth: function (gas, yearRange, store) {
+                if (!store || !yearRange) {
+                    return [window.dash_clientside.no_update, window.dash_clientside.no_update];
+                }
+                var means = rangeMean(store, gas, yearRange[0], yearRange[1]);
+                var trace = Object.assign({}, store.template.data[0], {
+                    locations: means.codes,
+                    z: means.values,
+                    hovertext: means.names
+                });
+                var figure = {data: [trace], layout: store.template.layout};
+                return [figure, summary(means, yearRange)];
+            },
+
+            clip_line_chart: function (series, gas, yearRange) {
+                if (!series || !yearRange) {
+                    return window.dash_clientside.no_update;
+                }
+                var traces = [];
+                (series.traces[gas] || []).forEach(function (trace) {
+                    var x = [], y = [];
+                    for (var i = 0; i < trace.x.length; i++) {
+                        if (trace.x[i] >= yearRange[0] && trace.x[i] <= yearRange[1]) {
+                            x.push(trace.x[i]);
+                            y.push(trace.y[i]);
+                        }
+                    }
+                    if (x.length) {
+                        traces.push(Object.assign({}, trace, {x: x, y: y}));
+                    }
+                });
+                return {data: traces, layout: series.layout};
+            }
+        }
+    });
+})();
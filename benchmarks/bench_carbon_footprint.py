@@ -0,0 +1,54 @@
+"""Throughput of the vectorized carbon footprint scorer and the bulk CSV path.
+
+    python benchmarks/bench_carbon_footprint.py --rows 5000000
+"""
+import argparse
+import io
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from carbon_footprint import FIELDS, NUMERIC_FIELDS, score_households, stream_scores  # noqa: E402
+
+
+def synthetic_households(n, seed=0):
+    rng = np.random.default_rng(seed)
+    columns = {field: rng.gamma(2.0, 50.0, n) for field in NUMERIC_FIELDS}
+    columns['mileage'] = rng.gamma(2.0, 6000.0, n)
+    columns['flights_short'] = rng.poisson(2, n).astype(np.float64)
+    columns['flights_long'] = rng.poisson(1, n).astype(np.float64)
+    for field in FIELDS:
+        if field not in columns:
+            columns[field] = rng.random(n) < 0.5
+    return columns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=5_000_000, help='households for the in-memory scorer')
+    parser.add_argument('--csv-rows', type=int, default=200_000, help='households for the CSV stream')
+    args = parser.parse_args()
+
+    columns = synthetic_households(args.rows)
+    t0 = time.perf_counter()
+    footprint, _ = score_households(columns)
+    elapsed = time.perf_counter() - t0
+    print(f"scorer:     {args.rows:>10} rows in {elapsed:.3f}s  ({args.rows / elapsed / 1e6:.1f} M rows/s)")
+
+    df = pd.DataFrame({field: values[:args.csv_rows] for field, values in columns.items()})
+    for field in FIELDS:
+        if df[field].dtype == bool:
+            df[field] = np.where(df[field], 'Yes', 'No')
+    body = df.to_csv(index=False).encode()
+    t0 = time.perf_counter()
+    out_bytes = sum(len(part) for part in stream_scores(io.BytesIO(body), 'text/csv')[0])
+    elapsed = time.perf_counter() - t0
+    print(f"csv stream: {args.csv_rows:>10} rows in {elapsed:.3f}s  ({args.csv_rows / elapsed / 1e3:.0f} k rows/s, {out_bytes / 1e6:.1f} MB out)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Compare EmissionsCube against the groupby path used by display_choropleth.
+
+Runs every [start, end] range the year_range_slider marks allow (1960-2040,
+step 4) for every gas and reports timings and whether the results match.
+The cube is built from the frame the app holds, with the snapshot's compact
+dtypes and row order (FLOAT32_RTOL applies), and compared with the groupby
+of the CSV as read_csv parses it. The cube returns the correctly rounded
+mean, so values may differ from the pandas groupby by an ulp; anything
+beyond a relative 1e-12 is a mismatch.
+
+    python benchmarks/bench_choropleth_cube.py --data ./df_final.csv
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from aggregates import EmissionsCube  # noqa: E402
+from data_loader import SORT_KEYS, compact_dtypes  # noqa: E402
+
+
+def slider_ranges(first=1960, last=2040, step=4):
+    marks = list(range(first, last + 1, step))
+    return [(start, end) for i, start in enumerate(marks) for end in marks[i:]]
+
+
+def groupby_path(df_final, gas, start, end):
+    df3 = df_final[(df_final['Gas'] == gas) & (df_final['Year'] >= start) & (df_final['Year'] <= end)]
+    return df3.groupby(['CountryName', 'CountryCode']).mean(numeric_only=True).reset_index()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', default='./df_final.csv', help='path to df_final.csv')
+    args = parser.parse_args()
+
+    df_final = pd.read_csv(args.data)
+    queries = [(gas, start, end) for gas in df_final['Gas'].unique() for start, end in slider_ranges()]
+
+    compact = compact_dtypes(df_final).sort_values(SORT_KEYS['df_final.csv'], kind='stable', ignore_index=True)
+
+    t0 = time.perf_counter()
+    cube = EmissionsCube(compact)
+    build_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    expected = [groupby_path(df_final, *q) for q in queries]
+    groupby_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    actual = [cube.range_mean(*q) for q in queries]
+    cube_time = time.perf_counter() - t0
+
+    mismatches = 0
+    bit_identical = 0
+    max_rel_diff = 0.0
+    for exp, act in zip(expected, actual):
+        same_keys = (exp['CountryName'].tolist() == act['CountryName'].tolist()
+                     and exp['CountryCode'].tolist() == act['CountryCode'].tolist())
+        a = exp['allsectors'].to_numpy(dtype=np.float64)
+        b = act['allsectors'].to_numpy(dtype=np.float64)
+        if not same_keys:
+            mismatches += 1
+            continue
+        if np.array_equal(a, b, equal_nan=True):
+            bit_identical += 1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rel = np.abs(a - b) / np.abs(a)
+        max_rel_diff = max(max_rel_diff, float(np.nanmax(rel, initial=0.0)))
+        if not np.allclose(a, b, rtol=1e-12, atol=0.0, equal_nan=True):
+            mismatches += 1
+
+    n = len(queries)
+    print(f"rows: {len(df_final)}  queries: {n}  allsectors stored as {compact['allsectors'].dtype}")
+    print(f"cube build:  {build_time * 1000:9.2f} ms")
+    print(f"groupby:     {groupby_time * 1000:9.2f} ms  ({groupby_time / n * 1e6:8.1f} us/query)")
+    print(f"cube:        {cube_time * 1000:9.2f} ms  ({cube_time / n * 1e6:8.1f} us/query)")
+    print(f"speedup:     {groupby_time / cube_time:9.1f}x")
+    print(f"identical:   {bit_identical}/{n}  (max relative diff {max_rel_diff:g})")
+    print(f"mismatches:  {mismatches}")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Compare memory and mask/groupby speed of df_final as read_csv parses it and with compact dtypes.
+
+    python benchmarks/bench_dtypes.py --data ./data
+    python benchmarks/bench_dtypes.py --countries 190 --repeat 50
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from data_loader import SORT_KEYS, compact_dtypes
+import synthetic_data
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def operations(df, compact):
+    codes = df['CountryCode'].drop_duplicates().tolist()[:5]
+    actual = (lambda: ~df['predicted']) if compact else (lambda: df['predicted'] == 'No')
+    n_actual = int((~df['predicted']).sum()) if compact else None
+    grouping = {'observed': True} if compact else {}
+    return {
+        'line chart mask': lambda: df[df['CountryCode'].isin(codes) & (df['Gas'] == 'GHG')
+                                      & (df['Year'] >= 1990) & (df['Year'] <= 2018)],
+        'historical subset': (lambda: df.iloc[:n_actual]) if compact else (lambda: df[actual()].copy()),
+        'groupby country, year': lambda: df.groupby(['CountryName', 'Year'], **grouping)['allsectors'].sum(),
+        'groupby predicted, code': lambda: df.groupby(['predicted', 'CountryCode'], sort=False, **grouping).indices,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--data', help='directory with df_final.csv (default: synthetic data)')
+    parser.add_argument('--countries', type=int, default=190, help='size of the synthetic data set')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.data:
+        path = os.path.join(args.data, 'df_final.csv')
+    else:
+        directory = tempfile.mkdtemp(prefix='ghg-dtypes-')
+        synthetic_data.write(directory, n_countries=args.countries)
+        path = os.path.join(directory, 'df_final.csv')
+
+    default = pd.read_csv(path)
+    t0 = time.perf_counter()
+    unsorted = compact_dtypes(default)
+    compact = unsorted.sort_values(SORT_KEYS['df_final.csv'], kind='stable', ignore_index=True)
+    compact_s = time.perf_counter() - t0
+
+    print(f"{len(default)} rows, compacted in {compact_s:.3f}s")
+    print(f"{'column':<20}{'default':>12}{'compact':>12}")
+    for name in default.columns:
+        print(f"{name[:19]:<20}{str(default[name].dtype):>12}{str(compact[name].dtype):>12}")
+    default_mb = default.memory_usage(deep=True).sum() / 1e6
+    compact_mb = compact.memory_usage(deep=True).sum() / 1e6
+    print(f"\n{'memory MB':<26}{default_mb:>10.2f}{compact_mb:>10.2f}{default_mb / compact_mb:>9.1f}x")
+
+    floats = [name for name in default.columns if compact[name].dtype == np.float32]
+    if floats:
+        a = default[floats].to_numpy()
+        b = unsorted[floats].to_numpy(dtype=np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            error = np.nanmax(np.abs(a - b) / np.abs(a))
+        print(f"{'float32 max rel error':<26}{error:>20.2e}")
+
+    print(f"\n{'operation (best, ms)':<26}{'default':>10}{'compact':>10}{'speedup':>9}")
+    slow, fast = operations(default, False), operations(compact, True)
+    for name in slow:
+        t_slow = best_of(slow[name], args.repeat)
+        t_fast = best_of(fast[name], args.repeat)
+        print(f"{name:<26}{t_slow * 1000:>10.2f}{t_fast * 1000:>10.2f}{t_slow / t_fast:>8.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""Time the batched trend fit of the predicted rows against a polyfit per series and check it against the CSV's rows.
+
+    python benchmarks/bench_forecast.py --countries 190,1000,5000 --loop-series 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aggregates import SECTOR_ID_COLUMNS
+from data_loader import SORT_KEYS, compact_dtypes
+from forecast import SERIES_KEYS, SIGNED_COLUMNS, forecast_rows
+import synthetic_data
+
+
+def polyfit_loop(df_actual, columns, future, limit):
+    """Predictions of the first ``limit`` (series, sector) pairs fitted one by one, as a loop per country would."""
+    out = {}
+    for key, rows in df_actual.groupby(SERIES_KEYS, observed=True, sort=True):
+        x = rows['Year'].to_numpy(dtype=np.float64)
+        for col in columns:
+            y = rows[col].to_numpy(dtype=np.float64)
+            keep = ~np.isnan(y)
+            if keep.sum() >= 2:
+                out[key + (col,)] = np.polyval(np.polyfit(x[keep], y[keep], 1), future)
+            if len(out) >= limit:
+                return out
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--countries', default='190,1000,5000', help='comma separated sizes of the synthetic data')
+    parser.add_argument('--loop-series', type=int, default=2000, help='(series, sector) pairs fitted one by one')
+    args = parser.parse_args()
+
+    print(f"{'countries':>10}{'series':>9}{'batch s':>9}{'series/s':>12}{'loop series/s':>15}"
+          f"{'max diff loop':>15}{'median diff CSV':>17}")
+    for n_countries in [int(n) for n in args.countries.split(',')]:
+        df = compact_dtypes(synthetic_data.generate(n_countries=n_countries)[0])
+        df = df.sort_values(SORT_KEYS['df_final.csv'], kind='stable', ignore_index=True)
+        columns = [col for col in df.columns if col not in SECTOR_ID_COLUMNS]
+        df_actual, df_csv = df[~df['predicted']], df[df['predicted']]
+        last_year = int(df['Year'].max())
+
+        t0 = time.perf_counter()
+        predicted = forecast_rows(df_actual, columns, last_year=last_year, window=0)
+        batch_s = time.perf_counter() - t0
+        future = np.arange(int(df_actual['Year'].max()) + 1, last_year + 1)
+        n_series = len(predicted) // len(future) * len(columns)
+
+        t0 = time.perf_counter()
+        loop = polyfit_loop(df_actual, columns, future, args.loop_series)
+        loop_s = time.perf_counter() - t0
+
+        indexed = predicted.set_index(SERIES_KEYS).sort_index()
+        loop_diff = 0.0
+        for (country, gas, col), expected in loop.items():
+            got = indexed.loc[(country, gas), col].to_numpy(dtype=np.float64)
+            if col in SIGNED_COLUMNS or (expected >= 0).all():
+                loop_diff = max(loop_diff, float(np.max(np.abs(got - expected) / np.maximum(np.abs(expected), 1))))
+
+        # the synthetic predicted rows follow the same linear trends plus noise; LUCF changes sign at random
+        keys = SERIES_KEYS + ['Year']
+        csv = df_csv.set_index(keys).sort_index()
+        ours = predicted.set_index(keys).sort_index()
+        unsigned = [col for col in columns if col not in SIGNED_COLUMNS]
+        a, b = csv[unsigned].to_numpy(np.float64), ours[unsigned].to_numpy(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            csv_diff = np.nanmedian(np.abs(a - b) / np.abs(a))
+        assert list(predicted.columns) == list(df.columns) and (predicted.dtypes == df.dtypes).all()
+
+        print(f"{n_countries:>10}{n_series:>9}{batch_s:>9.3f}{n_series / batch_s:>12.0f}{len(loop) / loop_s:>15.0f}"
+              f"{loop_diff:>15.1e}{csv_diff:>17.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Exercise the data loader against the local S3 stand-in: cold fetch timing, retries and the snapshot fallback.
+
+    python benchmarks/bench_loader.py --countries 1000 --latency 0.2
+"""
+import argparse
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import data_loader
+import local_s3
+import synthetic_data
+
+KEYS = ['df_final.csv', 'countries.csv']
+
+
+def source_for(data_dir, **faults):
+    server, endpoint = local_s3.serve(data_dir, **faults)
+    os.environ.update(GHG_S3_ENDPOINT_URL=endpoint, AWS_ACCESS_KEY='local', AWS_SECRET_KEY='local')
+    return server, data_loader.S3Source('bench')
+
+
+def load(source, snapshot_dir, workers=data_loader.FETCH_WORKERS):
+    t0 = time.perf_counter()
+    _, _, timings = data_loader.load_tables(KEYS, source, snapshot_dir, workers=workers)
+    return time.perf_counter() - t0, timings
+
+
+def peak_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--countries', type=int, default=1000, help='size of the synthetic data set')
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds the stand-in adds to every request')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='ghg-loader-')
+    try:
+        data_dir = os.path.join(work_dir, 'data')
+        synthetic_data.write(data_dir, n_countries=args.countries)
+        results = []
+
+        server, source = source_for(data_dir, latency=args.latency)
+        for workers in (1, len(KEYS)):
+            seconds, timings = load(source, os.path.join(work_dir, f'snapshot-{workers}'), workers)
+            results.append((f"cold, {workers} worker(s)", seconds, timings['df_final.csv']['source']))
+        seconds, timings = load(source, os.path.join(work_dir, f'snapshot-{len(KEYS)}'))
+        results.append(("warm snapshot", seconds, timings['df_final.csv']['source']))
+
+        body = source.open('df_final.csv').read()
+        buffered = peak_mb(lambda: pd.read_csv(io.BytesIO(source.open('df_final.csv').read())))
+        streamed = peak_mb(lambda: data_loader.fetch_csv(source, 'df_final.csv'))
+        server.shutdown()
+
+        server, source = source_for(data_dir, fail=1, truncate=1)
+        seconds, timings = load(source, os.path.join(work_dir, 'snapshot-retry'))
+        results.append(("503 then truncated body", seconds, timings['df_final.csv']['source']))
+        server.shutdown()
+
+        # a changed object that cannot be fetched leaves the last good snapshot in use
+        with open(os.path.join(data_dir, 'df_final.csv'), 'ab') as f:
+            f.write(body.splitlines(keepends=True)[-1])
+        server, source = source_for(data_dir, fail=data_loader.FETCH_RETRIES + 1)
+        seconds, timings = load(source, os.path.join(work_dir, 'snapshot-retry'))
+        results.append(("fetch keeps failing", seconds, timings['df_final.csv']['source']))
+        server.shutdown()
+
+        print()
+        print(f"{'scenario':<28}{'seconds':>10}  df_final.csv from")
+        for name, seconds, origin in results:
+            print(f"{name:<28}{seconds:>10.3f}  {origin}")
+        print(f"\npeak traced memory parsing df_final.csv ({len(body) / 1e6:.1f} MB): "
+              f"buffered {buffered:.1f} MB, streamed {streamed:.1f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
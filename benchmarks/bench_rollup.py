@@ -0,0 +1,102 @@
+"""Time the treemap and sector sunburst built by px from the rows and by the hierarchical rollup.
+
+    python benchmarks/bench_rollup.py --countries 190,1000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import plotly.express as px
+import plotly.graph_objects as go
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aggregates import SECTOR_EXCLUDED_COLUMNS, SECTOR_ID_COLUMNS, RollupStore, hierarchy
+from data_loader import compact_dtypes
+import synthetic_data
+
+SELECTED = ['USA', 'CHN', 'IND']
+YEARS = (1990, 2030)
+PATH = ['Region', 'CountryName', 'Gas', 'Sector']
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def payload_kb(fig):
+    return len(fig.to_json()) / 1e3
+
+
+def sector_table(df, sectors):
+    """df_final melted into one row per sector, as the sunburst used to be built from."""
+    table = df.melt(id_vars=SECTOR_ID_COLUMNS, value_vars=sectors, var_name='Sector', value_name='Emissions')
+    for col in ['Region', 'CountryName', 'CountryCode', 'Gas', 'Sector']:
+        table[col] = table[col].astype('category')
+    return table
+
+
+def sum_by(df, columns, value='Emissions'):
+    """Sum ``value`` over ``columns``, keeping only observed categories as plain strings."""
+    out = df.groupby(columns, observed=True, sort=False)[value].sum().reset_index()
+    return out.astype({col: str for col in columns})
+
+
+def treemap_px(df):
+    df_tree = sum_by(df, ['Region', 'CountryName'], value='allsectors')
+    return px.treemap(df_tree, path=[px.Constant("world"), 'Region', 'CountryName'], values='allsectors', color='Region')
+
+
+def treemap_rollup(rollup, start=None, end=None):
+    leaves = rollup.leaves(['allsectors'], start=start, end=end, value='allsectors')
+    ids, labels, parents, values = hierarchy(leaves, ['Region', 'CountryName'], 'allsectors', root='world')
+    return go.Figure(go.Treemap(ids=ids, labels=labels, parents=parents, values=values, branchvalues='total'))
+
+
+def sunburst_px(table):
+    rows = table[table['CountryCode'].isin(SELECTED) & (table['Year'] >= YEARS[0]) & (table['Year'] <= YEARS[1])]
+    df_pie = sum_by(rows, PATH)
+    return px.sunburst(df_pie, path=PATH, values='Emissions')
+
+
+def sunburst_rollup(rollup, sectors):
+    df_pie = rollup.leaves(sectors, country_codes=SELECTED, start=YEARS[0], end=YEARS[1])
+    ids, labels, parents, values = hierarchy(df_pie, PATH, 'Emissions')
+    return go.Figure(go.Sunburst(ids=ids, labels=labels, parents=parents, values=values, branchvalues='total'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--countries', default='190,1000', help='comma separated sizes of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'countries':>10}{'rows':>10}{'rollup s':>10}{'figure':>10}{'px ms':>10}{'rollup ms':>11}"
+          f"{'px KB':>9}{'rollup KB':>11}")
+    for n_countries in [int(n) for n in args.countries.split(',')]:
+        df = compact_dtypes(synthetic_data.generate(n_countries=n_countries)[0])
+        sectors = [col for col in df.columns if col not in SECTOR_ID_COLUMNS + SECTOR_EXCLUDED_COLUMNS]
+        table = sector_table(df, sectors)
+        t0 = time.perf_counter()
+        rollup = RollupStore(df, sectors + ['allsectors'])
+        rollup_s = time.perf_counter() - t0
+
+        cases = [
+            ('treemap', lambda: treemap_px(df), lambda: treemap_rollup(rollup)),
+            ('sunburst', lambda: sunburst_px(table), lambda: sunburst_rollup(rollup, sectors)),
+        ]
+        for name, slow, fast in cases:
+            t_slow, t_fast = best_of(slow, args.repeat), best_of(fast, args.repeat)
+            print(f"{n_countries:>10}{len(df):>10}{rollup_s:>10.2f}{name:>10}{t_slow * 1000:>10.1f}{t_fast * 1000:>11.1f}"
+                  f"{payload_kb(slow()):>9.1f}{payload_kb(fast()):>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
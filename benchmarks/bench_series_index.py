@@ -0,0 +1,65 @@
+"""Time line chart row lookups with full-frame masks and with SeriesIndex as the data grows.
+
+    python benchmarks/bench_series_index.py --countries 190,1000,5000 --repeat 50
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from aggregates import SeriesIndex
+from data_loader import compact_dtypes
+import synthetic_data
+
+SELECTED = ['USA', 'CHN', 'IND']
+YEARS = (1990, 2030)
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def line_rows_masked(df):
+    mask = df['CountryCode'].isin(SELECTED) & (df['Gas'] == 'GHG') & (df['Year'] >= YEARS[0]) & (df['Year'] <= YEARS[1])
+    trimmed = df[mask]
+    return trimmed.groupby(['predicted', 'CountryCode'], observed=True, sort=False).indices
+
+
+def line_rows_indexed(index):
+    return [index.rows((country, 'GHG', predicted), *YEARS) for predicted in (False, True) for country in SELECTED]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--countries', default='190,1000,5000', help='comma separated sizes of the synthetic data')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'countries':>10}{'rows':>10}{'index s':>9}{'line mask ms':>14}{'line index ms':>15}")
+    for n_countries in [int(n) for n in args.countries.split(',')]:
+        df = compact_dtypes(synthetic_data.generate(n_countries=n_countries)[0])
+        t0 = time.perf_counter()
+        series_index = SeriesIndex(df[['CountryCode', 'CountryName', 'Gas', 'predicted', 'Year', 'allsectors']],
+                                   ['CountryCode', 'Gas', 'predicted'])
+        index_s = time.perf_counter() - t0
+
+        timings = [
+            best_of(lambda: line_rows_masked(df), args.repeat),
+            best_of(lambda: line_rows_indexed(series_index), args.repeat),
+        ]
+        line = f"{n_countries:>10}{len(df):>10}{index_s:>9.2f}"
+        for width, seconds in zip((14, 15), timings):
+            line += f"{seconds * 1000:>{width}.3f}"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,362 @@
+"""Drive the Dash callback endpoint with scripted request mixes and report latency.
+
+    python benchmarks/load_test.py --workers 1,2,4 --countries 190 --requests 300
+    python benchmarks/load_test.py --url http://127.0.0.1:8050 --mix slider
+
+Without --url, synthetic data is generated, served through the local S3
+stand-in (benchmarks/local_s3.py) and gunicorn is started once per worker
+count. Each mix replays what the page sends to /_dash-update-component:
+  slider     year range drags, firing the choropleth, line chart and sunburst
+  select     multi-country dropdown changes, firing the line chart and sunburst
+  boxselect  map box-selects, firing the line chart and sunburst
+p50/p99 latency and throughput are reported per callback and worker count.
+Callbacks the app runs in the browser (CLIENTSIDE_MODE) are not sent.
+With --parallel the callbacks of one interaction are sent at once, as the
+browser does, and the time until the last one answers is reported as the
+"interaction" row; --threads sets gunicorn's threads per worker.
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.insert(0, BENCH_DIR)
+
+import local_s3
+import synthetic_data
+
+GASES = ['Carbon dioxide(CO2)', 'Nitrous oxide(N2O)', 'methane(CH4)', 'GHG']
+YEARS = list(range(1960, 2041, 4))
+MIXES = ['slider', 'select', 'boxselect']
+
+
+def callback_body(outputs, inputs, changed):
+    """Request body of one callback, as dash-renderer posts it."""
+    outputs = [{'id': i, 'property': p} for i, p in outputs]
+    if len(outputs) == 1:
+        output = f"{outputs[0]['id']}.{outputs[0]['property']}"
+        outputs = outputs[0]
+    else:
+        output = '..' + '...'.join(f"{o['id']}.{o['property']}" for o in outputs) + '..'
+    return {
+        'output': output,
+        'outputs': outputs,
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'changedPropIds': [f"{i}.{p}" for i, p in changed],
+        'state': [],
+    }
+
+
+def choropleth(gas, years):
+    return callback_body(
+        [('choropleth_graph', 'figure'), ('choropleth_text', 'children')],
+        [('slct_gas', 'value', gas), ('year_range_slider', 'value', years)],
+        [('year_range_slider', 'value')])
+
+
+def line_chart(countries, gas, selected, years, changed):
+    return callback_body(
+        [('country_line_chart', 'figure')],
+        [('slct_country', 'value', countries), ('slct_gas', 'value', gas),
+         ('choropleth_graph', 'selectedData', selected), ('year_range_slider', 'value', years)],
+        [changed])
+
+
+def line_series(countries, selected, changed):
+    # CLIENTSIDE_MODE replaces the line chart callback with this one
+    return callback_body(
+        [('line_chart_series', 'data')],
+        [('slct_country', 'value', countries), ('choropleth_graph', 'selectedData', selected)],
+        [changed])
+
+
+def sunburst(countries, selected, years, changed):
+    return callback_body(
+        [('sunburst_chart', 'figure')],
+        [('slct_country', 'value', countries), ('choropleth_graph', 'selectedData', selected),
+         ('year_range_slider', 'value', years)],
+        [changed])
+
+
+def random_years(rng):
+    start, end = sorted(rng.sample(YEARS, 2))
+    return [start, end]
+
+
+def scenario(mix, rng, codes):
+    """One user interaction: a list of (callback name, body) fired together."""
+    gas = rng.choice(GASES)
+    countries = rng.sample(codes, rng.randint(1, min(5, len(codes))))
+    years = random_years(rng)
+    if mix == 'slider':
+        changed = ('year_range_slider', 'value')
+        return [('choropleth', choropleth(gas, years)),
+                ('line_chart', line_chart(countries, gas, None, years, changed)),
+                ('sunburst', sunburst(countries, None, years, changed))]
+    if mix == 'select':
+        countries = rng.sample(codes, rng.randint(2, min(12, len(codes))))
+        changed = ('slct_country', 'value')
+        return [('line_chart', line_chart(countries, gas, None, years, changed)),
+                ('line_series', line_series(countries, None, changed)),
+                ('sunburst', sunburst(countries, None, years, changed))]
+    selected = {'points': [{'location': code} for code in rng.sample(codes, rng.randint(1, min(30, len(codes))))]}
+    changed = ('choropleth_graph', 'selectedData')
+    return [('line_chart', line_chart(countries, gas, selected, years, changed)),
+            ('line_series', line_series(countries, selected, changed)),
+            ('sunburst', sunburst(countries, selected, years, changed))]
+
+
+class Client:
+    def __init__(self, url, timeout=60):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.prefix = parsed.path.rstrip('/')
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None):
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                headers = {'Content-Type': 'application/json'} if body is not None else {}
+                self.conn.request(method, self.prefix + path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = response.read()
+                return response.status, data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+    def post_callback(self, body):
+        return self.request('POST', '/_dash-update-component', json.dumps(body).encode())
+
+
+def country_codes(url):
+    """Country codes offered by the dropdown of the running app."""
+    status, data = Client(url).request('GET', '/_dash-layout')
+    if status != 200:
+        raise RuntimeError(f"GET /_dash-layout returned {status}")
+
+    def walk(node):
+        if isinstance(node, dict):
+            props = node.get('props', {})
+            if props.get('id') == 'slct_country':
+                return [option['value'] for option in props.get('options', [])]
+            for value in node.values():
+                found = walk(value)
+                if found:
+                    return found
+        elif isinstance(node, list):
+            for value in node:
+                found = walk(value)
+                if found:
+                    return found
+        return None
+
+    return walk(json.loads(data))
+
+
+def server_outputs(url):
+    """Outputs of the callbacks the server answers; clientside ones are skipped by the mixes."""
+    status, data = Client(url).request('GET', '/_dash-dependencies')
+    if status != 200:
+        raise RuntimeError(f"GET /_dash-dependencies returned {status}")
+    return {dep['output'] for dep in json.loads(data) if not dep.get('clientside_function')}
+
+
+def run_load(url, mixes, n_requests, concurrency, seed, warmup=3, parallel=False):
+    """Replay ``n_requests`` interactions per mix; returns {(mix, callback): [latency s]} and wall times."""
+    codes = country_codes(url)
+    outputs = server_outputs(url)
+
+    def interaction(mix, rng):
+        return [(callback, body) for callback, body in scenario(mix, rng, codes) if body['output'] in outputs]
+
+    latencies = {}
+    walls = {}
+    errors = 0
+    lock = threading.Lock()
+
+    warm = Client(url)
+    rng = random.Random(seed)
+    for mix in mixes:
+        for _ in range(warmup):
+            for _, body in interaction(mix, rng):
+                warm.post_callback(body)
+
+    for mix in mixes:
+        rng = random.Random(f"{seed}-{mix}")
+        queue = [interaction(mix, rng) for _ in range(n_requests)]
+        position = iter(range(len(queue)))
+
+        def worker():
+            nonlocal errors
+            # one connection per callback of an interaction, so parallel calls do not share one
+            clients = [Client(url) for _ in range(max(len(calls) for calls in queue))]
+
+            def send(j, body):
+                t0 = time.perf_counter()
+                status, _ = clients[j].post_callback(body)
+                return status, time.perf_counter() - t0
+
+            pool = ThreadPoolExecutor(len(clients)) if parallel else None
+            while True:
+                with lock:
+                    i = next(position, None)
+                if i is None:
+                    break
+                t0 = time.perf_counter()
+                if parallel:
+                    results = list(pool.map(send, range(len(queue[i])), [body for _, body in queue[i]]))
+                else:
+                    results = [send(0, body) for _, body in queue[i]]
+                elapsed = time.perf_counter() - t0
+                with lock:
+                    for (callback, _), (status, latency) in zip(queue[i], results):
+                        if status == 200:
+                            latencies.setdefault((mix, callback), []).append(latency)
+                        else:
+                            errors += 1
+                    if parallel:
+                        latencies.setdefault((mix, 'interaction'), []).append(elapsed)
+            if pool is not None:
+                pool.shutdown()
+
+        t0 = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        walls[mix] = time.perf_counter() - t0
+    if errors:
+        print(f"  {errors} callback requests failed")
+    return latencies, walls
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def start_gunicorn(workers, env, port, timeout=300, threads=1):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers), '--threads', str(threads), '-b', f"127.0.0.1:{port}",
+         '--timeout', '120', 'app:server'],
+        cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with {process.returncode}")
+        try:
+            if Client(url, timeout=5).request('GET', '/_dash-layout')[0] == 200:
+                return process, url
+        except OSError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('gunicorn did not come up')
+
+
+def stop(process):
+    process.terminate()
+    try:
+        process.wait(30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def report(rows):
+    print(f"{'workers':>8}  {'mix':<10}{'callback':<12}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'req/s':>10}")
+    for row in rows:
+        print(f"{row['workers']:>8}  {row['mix']:<10}{row['callback']:<12}{row['n']:>6}"
+              f"{row['p50_ms']:>10.1f}{row['p99_ms']:>10.1f}{row['throughput']:>10.1f}")
+
+
+def summarize(workers, latencies, walls):
+    rows = []
+    for (mix, callback), values in sorted(latencies.items()):
+        values = np.asarray(values) * 1000
+        rows.append({
+            'workers': workers, 'mix': mix, 'callback': callback, 'n': len(values),
+            'p50_ms': float(np.percentile(values, 50)), 'p99_ms': float(np.percentile(values, 99)),
+            'throughput': len(values) / walls[mix],
+        })
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', help='benchmark an already running app instead of starting gunicorn')
+    parser.add_argument('--workers', default='1,2,4', help='comma-separated gunicorn worker counts')
+    parser.add_argument('--mix', default=','.join(MIXES), help=f"comma-separated subset of {','.join(MIXES)}")
+    parser.add_argument('--requests', type=int, default=200, help='interactions per mix')
+    parser.add_argument('--concurrency', type=int, default=8, help='simultaneous clients')
+    parser.add_argument('--countries', type=int, default=190, help='size of the synthetic data set')
+    parser.add_argument('--data', help='directory with df_final.csv and countries.csv (default: synthetic)')
+    parser.add_argument('--cache-backend', default='none', choices=['memory', 'disk', 'none'],
+                        help='FIGURE_CACHE_BACKEND of the started app (default none, to time the callbacks)')
+    parser.add_argument('--threads', type=int, default=1, help='gunicorn threads per worker')
+    parser.add_argument('--parallel', action='store_true', help="send an interaction's callbacks at once, as the browser does")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='also write the rows to this file')
+    args = parser.parse_args()
+    mixes = [m for m in args.mix.split(',') if m]
+
+    rows = []
+    if args.url:
+        latencies, walls = run_load(args.url, mixes, args.requests, args.concurrency, args.seed, parallel=args.parallel)
+        rows = summarize('-', latencies, walls)
+    else:
+        work_dir = tempfile.mkdtemp(prefix='ghg-load-')
+        try:
+            data_dir = args.data
+            if data_dir is None:
+                data_dir = os.path.join(work_dir, 'data')
+                synthetic_data.write(data_dir, n_countries=args.countries, seed=args.seed)
+            server, endpoint = local_s3.serve(data_dir)
+            env = dict(os.environ, GHG_S3_ENDPOINT_URL=endpoint, AWS_ACCESS_KEY='local', AWS_SECRET_KEY='local',
+                       GHG_SNAPSHOT_DIR=os.path.join(work_dir, 'snapshot'), FIGURE_CACHE_BACKEND=args.cache_backend,
+                       FIGURE_CACHE_DIR=os.path.join(work_dir, 'figure-cache'))
+            env.pop('GHG_DATA_DIR', None)
+            for workers in [int(w) for w in args.workers.split(',')]:
+                process, url = start_gunicorn(workers, env, free_port(), threads=args.threads)
+                try:
+                    print(f"gunicorn -w {workers} --threads {args.threads}: running {args.requests} interactions per mix")
+                    latencies, walls = run_load(url, mixes, args.requests, args.concurrency, args.seed, parallel=args.parallel)
+                finally:
+                    stop(process)
+                rows += summarize(workers, latencies, walls)
+            server.shutdown()
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    report(rows)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Minimal S3 stand-in serving GET/HEAD /<bucket>/<key> from a local directory.
+
+    python benchmarks/local_s3.py --dir ./data --port 9000
+    GHG_S3_ENDPOINT_URL=http://127.0.0.1:9000 AWS_ACCESS_KEY=x AWS_SECRET_KEY=x gunicorn app:server
+
+Any bucket name maps to --dir and requests are not authenticated; it only
+implements what the data loader needs. --latency delays every request, and
+--fail / --truncate make the first GETs of each key answer 503 or drop the
+connection half way through the body, to exercise the loader's retries.
+"""
+import argparse
+import collections
+import hashlib
+import os
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+
+def make_handler(directory, latency=0.0, fail=0, truncate=0):
+    gets = collections.Counter()
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def _resolve(self):
+            parts = unquote(urlparse(self.path).path).lstrip('/').split('/', 1)
+            if len(parts) != 2 or not parts[1]:
+                return None
+            path = os.path.realpath(os.path.join(directory, parts[1]))
+            if not path.startswith(os.path.realpath(directory) + os.sep) or not os.path.isfile(path):
+                return None
+            return path
+
+        def _headers(self, path):
+            stat = os.stat(path)
+            with open(path, 'rb') as f:
+                etag = hashlib.md5(f.read()).hexdigest()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(stat.st_size))
+            self.send_header('ETag', f'"{etag}"')
+            self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+            self.end_headers()
+
+        def _not_found(self):
+            body = b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>NoSuchKey</Code><Message>Not found</Message></Error>'
+            self.send_response(404)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(body)
+
+        def _slow_down(self):
+            body = b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>SlowDown</Code><Message>Injected failure</Message></Error>'
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_HEAD(self):
+            time.sleep(latency)
+            path = self._resolve()
+            if path is None:
+                return self._not_found()
+            self._headers(path)
+
+        def do_GET(self):
+            time.sleep(latency)
+            path = self._resolve()
+            if path is None:
+                return self._not_found()
+            with lock:
+                gets[path] += 1
+                attempt = gets[path]
+            if attempt <= fail:
+                return self._slow_down()
+            self._headers(path)
+            with open(path, 'rb') as f:
+                if attempt <= fail + truncate:
+                    self.wfile.write(f.read(os.path.getsize(path) // 2))
+                    self.close_connection = True
+                    return
+                while True:
+                    block = f.read(1 << 16)
+                    if not block:
+                        break
+                    self.wfile.write(block)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(directory, host='127.0.0.1', port=0, latency=0.0, fail=0, truncate=0):
+    """Start the stand-in on a background thread; returns (server, endpoint_url)."""
+    server = ThreadingHTTPServer((host, port), make_handler(directory, latency, fail, truncate))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='./data', help='directory served as every bucket')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every request')
+    parser.add_argument('--fail', type=int, default=0, help='first GETs of each key answered with 503')
+    parser.add_argument('--truncate', type=int, default=0, help='following GETs of each key cut half way through the body')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.dir, args.latency, args.fail, args.truncate))
+    print(f"serving {args.dir} at http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,36 @@
+"""Report worker boot time, initial layout payload and per-figure build cost.
+
+    GHG_DATA_DIR=./data python benchmarks/startup_report.py
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def main():
+    t0 = time.perf_counter()
+    import app as dashboard
+    import_time = time.perf_counter() - t0
+
+    from plotly.utils import PlotlyJSONEncoder
+    layout_bytes = len(json.dumps(dashboard.serve_layout(), cls=PlotlyJSONEncoder))
+
+    state = dashboard.data.state
+    t0 = time.perf_counter()
+    state.static_figures.precompute()
+    state.race_figures.get(dashboard.race_key('all', 'allsectors'))
+    figures_time = time.perf_counter() - t0
+
+    print(f"import app:          {import_time:8.3f} s")
+    print(f"initial layout:      {layout_bytes / 1024:8.0f} KB")
+    print(f"build all figures:   {figures_time:8.3f} s")
+    print()
+    print(state.static_figures.report())
+    print(state.race_figures.report().split("\n", 1)[1])
+
+
+if __name__ == '__main__':
+    main()
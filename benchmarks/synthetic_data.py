@@ -0,0 +1,97 @@
+"""Generate df_final.csv and countries.csv with the dashboard's schema.
+
+    python benchmarks/synthetic_data.py --countries 190 --out ./data
+
+Rows are one (country, gas, year) each, with every sector column. Years after
+--last-actual-year are marked predicted='Yes' and follow each series' trend.
+"""
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+REGIONS = ['Asia', 'Europe', 'Africa', 'North America', 'South America', 'Oceania']
+GASES = ['Carbon dioxide(CO2)', 'Nitrous oxide(N2O)', 'methane(CH4)', 'GHG']
+SECTORS = ['LUCF', 'agriculture', 'allsectors', 'electricity and heat production', 'energy',
+           'gaseous fuel consumption', 'liquid fuel consumption', 'manufacturing industries and construction',
+           'other sectors, excluding residential buildings and commercial and public services',
+           'residential buildings and commercial and public services', 'solid fuel consumption', 'transport']
+KNOWN_COUNTRIES = [
+    ('USA', 'United States'), ('CHN', 'China'), ('RUS', 'Russian Federation'), ('IND', 'India'),
+    ('JPN', 'Japan'), ('GBR', 'United Kingdom'), ('CAN', 'Canada'), ('BRA', 'Brazil'),
+    ('DEU', 'Germany'), ('FRA', 'France'),
+]
+
+
+def country_list(n):
+    countries = KNOWN_COUNTRIES[:n]
+    for i in range(len(countries), n):
+        countries.append((f"X{i:03d}", f"Country {i}"))
+    return countries
+
+
+def generate(n_countries=190, first_year=1990, last_actual_year=2018, last_year=2040, seed=0, missing_rate=0.01):
+    """Return (df_final, df_countries) DataFrames."""
+    rng = np.random.default_rng(seed)
+    countries = country_list(n_countries)
+    years = np.arange(first_year, last_year + 1)
+    components = [s for s in SECTORS if s != 'allsectors']
+
+    n_series = n_countries * len(GASES)
+    n_rows = n_series * len(years)
+    country_idx = np.repeat(np.arange(n_countries), len(GASES) * len(years))
+    gas_idx = np.tile(np.repeat(np.arange(len(GASES)), len(years)), n_countries)
+    year = np.tile(years, n_series)
+
+    # each series: lognormal level, linear trend and noise
+    level = np.repeat(rng.lognormal(8, 2, (n_series, len(components))), len(years), axis=0)
+    trend = np.repeat(rng.normal(0.01, 0.02, (n_series, len(components))), len(years), axis=0)
+    t = (year - first_year)[:, None]
+    values = level * np.maximum(1 + trend * t, 0.05) * rng.normal(1, 0.05, (n_rows, len(components)))
+    values[:, components.index('LUCF')] *= rng.choice([-1, 1], n_rows) * 0.3
+    values = np.round(values, 2)
+
+    df = pd.DataFrame({
+        'Region': np.array([REGIONS[i % len(REGIONS)] for i in range(n_countries)], dtype=object)[country_idx],
+        'CountryName': np.array([name for _, name in countries], dtype=object)[country_idx],
+        'CountryCode': np.array([code for code, _ in countries], dtype=object)[country_idx],
+        'Year': year,
+        'Gas': np.array(GASES, dtype=object)[gas_idx],
+    })
+    for i, sector in enumerate(components):
+        df[sector] = values[:, i]
+    df['allsectors'] = np.round(values.sum(axis=1), 2)
+    if missing_rate:
+        df.loc[rng.random(n_rows) < missing_rate, 'allsectors'] = np.nan
+    df = df[['Region', 'CountryName', 'CountryCode', 'Year', 'Gas'] + SECTORS]
+    df['predicted'] = np.where(year > last_actual_year, 'Yes', 'No')
+
+    df_countries = pd.DataFrame({'CountryCode': [c for c, _ in countries], 'CountryName': [n for _, n in countries]})
+    return df, df_countries
+
+
+def write(directory, **kwargs):
+    os.makedirs(directory, exist_ok=True)
+    df, df_countries = generate(**kwargs)
+    df.to_csv(os.path.join(directory, 'df_final.csv'), index=False)
+    df_countries.to_csv(os.path.join(directory, 'countries.csv'), index=False)
+    return df, df_countries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--out', default='./data', help='output directory')
+    parser.add_argument('--countries', type=int, default=190)
+    parser.add_argument('--first-year', type=int, default=1990)
+    parser.add_argument('--last-actual-year', type=int, default=2018)
+    parser.add_argument('--last-year', type=int, default=2040)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    df, _ = write(args.out, n_countries=args.countries, first_year=args.first_year,
+                  last_actual_year=args.last_actual_year, last_year=args.last_year, seed=args.seed)
+    print(f"wrote {len(df)} rows to {args.out}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+import io
+import itertools
+import json
+
+import numpy as np
+import pandas as pd
+
+
+## CARBON FOOTPRINT MODEL
+# Pounds of CO2 per year for a household. Terms are added in this order so a
+# single household scores exactly as the calculator always has.
+EMISSION_TERMS = [
+    (('electricity_bill', 'gas_bill'), 105),  # monthly bills ($)
+    (('oil_bill',), 113),                      # monthly bill ($)
+    (('mileage',), 0.79),                      # yearly miles
+    (('flights_short',), 1100),                # flights under 4 hours
+    (('flights_long',), 4400),                 # flights over 4 hours
+]
+# Added when the household does not recycle
+NO_RECYCLING_PENALTIES = [('recycle_paper', 184), ('recycle_metal', 166)]
+
+NUMERIC_FIELDS = [field for fields, _ in EMISSION_TERMS for field in fields]
+RECYCLE_FIELDS = [field for field, _ in NO_RECYCLING_PENALTIES]
+FIELDS = NUMERIC_FIELDS + RECYCLE_FIELDS
+
+GAUGE_MAX = 40000
+CHUNK_ROWS = 10000
+
+
+def coerce_numeric(values):
+    """Float array of ``values``; missing, non-numeric and negative entries become 0.
+
+    Returns (array, invalid) where ``invalid`` flags entries that were present
+    but unusable.
+    """
+    if isinstance(values, np.ndarray) and values.dtype.kind in 'fiub':
+        array = values.astype(np.float64)
+        missing = np.isnan(array)
+    else:
+        series = pd.Series(values, dtype=object)
+        missing = (series.isna() | (series.astype(str).str.strip() == '')).to_numpy()
+        array = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64)
+    invalid = ~missing & ~(array >= 0)
+    array = np.where(array >= 0, array, 0.0)
+    return array, invalid
+
+
+def coerce_recycle(values):
+    """Boolean array, True where the household recycles; anything but a yes counts as 'No'."""
+    if isinstance(values, np.ndarray) and values.dtype == bool:
+        return values
+    series = pd.Series(values, dtype=object)
+    return series.astype(str).str.strip().str.lower().isin(['yes', 'y', 'true', '1']).to_numpy()
+
+
+def score_households(columns, n_rows=None):
+    """Score households given as ``{field: sequence}``; absent fields use their defaults.
+
+    Returns (footprint, invalid_count) arrays, both one entry per household.
+    """
+    if n_rows is None:
+        n_rows = max((len(columns[f]) for f in FIELDS if f in columns), default=0)
+
+    numeric = {}
+    invalid_count = np.zeros(n_rows, dtype=np.int64)
+    for field in NUMERIC_FIELDS:
+        if field in columns:
+            numeric[field], invalid = coerce_numeric(columns[field])
+            invalid_count += invalid
+        else:
+            numeric[field] = np.zeros(n_rows)
+
+    footprint = np.zeros(n_rows)
+    for fields, factor in EMISSION_TERMS:
+        total = numeric[fields[0]]
+        for field in fields[1:]:
+            total = total + numeric[field]
+        footprint += total * factor
+    for field, penalty in NO_RECYCLING_PENALTIES:
+        recycles = coerce_recycle(columns[field]) if field in columns else np.zeros(n_rows, dtype=bool)
+        footprint += np.where(recycles, 0, penalty)
+    return footprint, invalid_count
+
+
+def gauge_value(footprint):
+    return np.minimum(footprint, GAUGE_MAX)
+
+
+def _check_fields(df):
+    """Columns of ``df`` that are neither FIELDS nor ``id``; raises BulkInputError if none of FIELDS is present."""
+    unknown = [str(col) for col in df.columns if col not in FIELDS and col != 'id']
+    if not any(col in FIELDS for col in df.columns):
+        raise BulkInputError(f"no known field in the rows ({', '.join(unknown) or 'none given'}); "
+                             f"expected any of {', '.join(FIELDS)}")
+    return unknown
+
+
+def _score_frame(df):
+    _check_fields(df)
+    footprint, invalid = score_households({col: df[col].to_numpy() if df[col].dtype.kind in 'fiub' else df[col].tolist()
+                                           for col in df.columns if col in FIELDS}, n_rows=len(df))
+    out = pd.DataFrame({'footprint': footprint, 'indicator': gauge_value(footprint), 'invalid_fields': invalid})
+    if 'id' in df.columns:
+        out.insert(0, 'id', df['id'].to_numpy())
+    return out
+
+
+class BulkInputError(ValueError):
+    """A bulk request body that cannot be read as rows of household fields."""
+
+
+def _read_json_chunks(stream):
+    try:
+        body = json.load(stream)
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise BulkInputError(f"invalid JSON: {e}") from None
+    rows = body.get('rows', []) if isinstance(body, dict) else body
+    if not isinstance(rows, list):
+        raise BulkInputError("expected a JSON array of rows or an object with a 'rows' array")
+    # the whole body is in memory already, so every row is checked before the first is scored
+    for i, row in enumerate(rows, 1):
+        if not isinstance(row, dict):
+            raise BulkInputError(f"row {i} is not an object")
+    for start in range(0, len(rows), CHUNK_ROWS):
+        yield pd.DataFrame.from_records(rows[start:start + CHUNK_ROWS])
+
+
+def _text_lines(stream):
+    try:
+        yield from io.TextIOWrapper(stream, encoding='utf-8')
+    except UnicodeDecodeError as e:
+        raise BulkInputError(f"invalid UTF-8: {e}") from None
+
+
+def _read_ndjson_chunks(stream):
+    records = []
+    for i, line in enumerate(_text_lines(stream), 1):
+        if line.strip():
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise BulkInputError(f"invalid JSON on line {i}: {e}") from None
+            if not isinstance(records[-1], dict):
+                raise BulkInputError(f"line {i} is not an object")
+        if len(records) == CHUNK_ROWS:
+            yield pd.DataFrame.from_records(records)
+            records = []
+    if records:
+        yield pd.DataFrame.from_records(records)
+
+
+def _read_csv_chunks(stream):
+    try:
+        for chunk in pd.read_csv(stream, chunksize=CHUNK_ROWS):
+            yield chunk
+    except pd.errors.EmptyDataError:
+        return
+    except (pd.errors.ParserError, UnicodeDecodeError) as e:
+        raise BulkInputError(f"invalid CSV: {str(e).strip()}") from None
+
+
+def _score_lines(first, chunks, csv):
+    header = True
+    try:
+        for chunk in itertools.chain([first] if first is not None else [], chunks):
+            scores = _score_frame(chunk)
+            if csv:
+                yield scores.to_csv(index=False, header=header)
+            else:
+                yield scores.to_json(orient='records', lines=True).rstrip('\n') + '\n'
+            header = False
+    except BulkInputError as e:
+        # the status line is long gone, so the stream ends with the error instead
+        yield f"error,{json.dumps(str(e))}\n" if csv else json.dumps({'error': str(e)}) + '\n'
+        return
+    if csv and header:
+        yield 'footprint,indicator,invalid_fields\n'
+
+
+def stream_scores(stream, content_type):
+    """(response body generator, ignored columns) for a bulk request, one output line per input row.
+
+    CSV in gives CSV out; JSON arrays and newline-delimited JSON give NDJSON.
+    Rows are scored in vectorized chunks of CHUNK_ROWS. The first chunk is
+    read and checked here, so a body that cannot be parsed or has none of
+    FIELDS raises BulkInputError before any of the response is sent; a
+    later chunk that fails ends the stream with an error line. The ignored
+    columns are those of the first chunk other than FIELDS and ``id``.
+    """
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    if content_type == 'text/csv':
+        chunks = _read_csv_chunks(stream)
+    elif content_type == 'application/x-ndjson':
+        chunks = _read_ndjson_chunks(stream)
+    else:
+        chunks = _read_json_chunks(stream)
+    first = next(chunks, None)
+    ignored = _check_fields(first) if first is not None else []
+    return _score_lines(first, chunks, content_type == 'text/csv'), ignored
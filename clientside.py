@@ -0,0 +1,70 @@
+import base64
+import json
+import os
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+
+## CLIENTSIDE MODE
+# With CLIENTSIDE_MODE=1 the per-year, per-gas country aggregates of the
+# choropleth are shipped to the browser once, as base64 typed arrays in a
+# dcc.Store, and assets/clientside.js recolors the map, writes the summary
+# text and clips the line chart to the slider range without a round trip.
+# The server only answers when the country selection changes (line chart
+# series) and for the sector sunburst.
+
+CLIENTSIDE_MODE = os.environ.get('CLIENTSIDE_MODE', '0').lower() in ('1', 'true', 'yes')
+
+
+def encode_array(values, dtype):
+    """Little-endian typed array as {'dtype', 'bdata'}, decoded by assets/clientside.js."""
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': np.dtype(dtype).str.lstrip('<|'), 'shape': list(array.shape),
+            'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+
+def plain(value):
+    """``value`` as plain JSON types, the way Dash would send it."""
+    return json.loads(json.dumps(value, cls=PlotlyJSONEncoder))
+
+
+def emissions_store(cube, template, column='allsectors'):
+    """Data of the emissions dcc.Store: countries, years and per-gas yearly sums and counts.
+
+    ``template`` is a choropleth figure whose first trace gets the colors;
+    its locations, z and hover arrays are dropped.
+    """
+    years, _ = cube.yearly(None, column)
+    template = plain(template)
+    for key in ('locations', 'z', 'hovertext', 'customdata'):
+        template['data'][0].pop(key, None)
+
+    gases = {}
+    for gas in cube.gases:
+        _, sums = cube.yearly(gas, column)
+        rows, counts = cube.yearly_counts(gas, column)
+        largest = max(rows.max(initial=0), counts.max(initial=0))
+        count_dtype = 'u1' if largest <= np.iinfo(np.uint8).max else 'u2' if largest <= np.iinfo(np.uint16).max else 'u4'
+        gases[gas] = {'sums': encode_array(sums, 'f8'), 'counts': encode_array(counts, count_dtype)}
+        # Row counts only differ from value counts where the column has NaNs
+        if not np.array_equal(rows, counts):
+            gases[gas]['rows'] = encode_array(rows, count_dtype)
+    return {
+        'codes': cube.countries['CountryCode'].tolist(),
+        'names': cube.countries['CountryName'].tolist(),
+        'first_year': int(years[0]) if len(years) else None,
+        'n_years': len(years),
+        'gases': gases,
+        'template': template,
+    }
+
+
+def line_series_store(series, layout):
+    """Data of the line chart dcc.Store: every gas' traces over all years and the figure layout."""
+    return {
+        'layout': plain(layout),
+        'traces': {gas: [{'type': 'scatter', 'x': np.asarray(x).tolist(), 'y': np.asarray(y).tolist(),
+                          'name': name, 'line': plain(line)} for name, x, y, line in traces]
+                   for gas, traces in series.items()},
+    }
@@ -0,0 +1,226 @@
+import collections
+import functools
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+from payload import record_payload, serialize
+
+
+## FIGURE CACHE
+# The data callbacks are pure functions of their inputs, so their serialized
+# outputs can be memoized. Backends store JSON strings under a hashed key:
+#   memory - per-process LRU bounded by bytes
+#   disk   - LRU directory shared by every gunicorn worker on the host
+# Configure with FIGURE_CACHE_BACKEND (memory|disk|none), FIGURE_CACHE_DIR
+# and FIGURE_CACHE_MAX_MB. Keys include the data version, so entries of a
+# replaced data set are never served and age out of the LRU, as well as the
+# settings that shape the figures (``config``) and FIGURE_CACHE_VERSION.
+# Every result is serialized once whatever the backend, none included, so
+# payload.py has the size and encode time of each figure.
+
+# Bump when a memoized callback changes so a deploy does not serve the
+# previous figures from the shared disk cache.
+FIGURE_CACHE_VERSION = 1
+
+
+class MemoryBackend:
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskBackend:
+    # One file per entry; the file mtime is the LRU clock, bumped on every hit.
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.json'):
+                    try:
+                        os.unlink(entry.path)
+                    except OSError:
+                        pass
+
+
+def _unique(values, keep_order):
+    return list(dict.fromkeys(values)) if keep_order else sorted(set(values))
+
+
+def normalize_selection(selected_data, keep_order=False):
+    # Only the selected locations matter to the callbacks.
+    if not selected_data or not selected_data.get('points'):
+        return None
+    locations = _unique([item['location'] for item in selected_data['points'] if 'location' in item], keep_order)
+    return {'points': [{'location': location} for location in locations]}
+
+
+def normalize_input(value, keep_order=False):
+    if isinstance(value, dict) and 'points' in value:
+        return normalize_selection(value, keep_order)
+    if isinstance(value, list) and value and all(isinstance(item, str) for item in value):
+        return _unique(value, keep_order)
+    return value
+
+
+class FigureCache:
+    def __init__(self, backend, data_version=None, config=''):
+        self.backend = backend
+        self.data_version = data_version or (lambda: None)
+        self.config = f"{FIGURE_CACHE_VERSION}-{config}"
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, data_version=None, config=''):
+        kind = os.environ.get('FIGURE_CACHE_BACKEND', 'memory').lower()
+        max_bytes = int(float(os.environ.get('FIGURE_CACHE_MAX_MB', '64')) * 1024 * 1024)
+        if kind == 'none':
+            return cls(None, data_version, config)
+        if kind == 'disk':
+            directory = os.environ.get('FIGURE_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'ghg-figure-cache'))
+            return cls(DiskBackend(directory, max_bytes), data_version, config)
+        return cls(MemoryBackend(max_bytes), data_version, config)
+
+    @staticmethod
+    def make_key(name, args, version=None):
+        payload = json.dumps([name, args] if version is None else [name, version, args], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+    def memoize(self, name, keep_order=False):
+        """Cache a callback's output keyed on its normalized inputs.
+
+        Country lists are deduplicated and map selections reduced to their
+        locations, then sorted unless ``keep_order`` is set for a callback
+        whose output follows the order countries were picked in (line colors).
+        The callback itself is called with the normalized inputs so equal keys
+        always mean equal figures.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                args = [normalize_input(arg, keep_order) for arg in args]
+                if self.backend is None:
+                    result = func(*args)
+                    # nothing to store, but the payload is measured all the same
+                    serialize(name, result)
+                    return result
+
+                version = self.data_version()
+                key = self.make_key(name, args, f"{self.config}-{version}")
+                cached = self.backend.get(key)
+                if cached is not None:
+                    self._count(True)
+                    record_payload(name, len(cached), source='cache')
+                    return json.loads(cached)
+
+                self._count(False)
+                result = func(*args)
+                serialized = serialize(name, result)
+                # built across a data swap: the result may come from either version
+                if self.data_version() == version:
+                    self.backend.set(key, serialized)
+                return result
+            return wrapper
+        return decorator
@@ -0,0 +1,112 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+
+## FORECAST
+# Rebuilds the predicted rows of df_final from its historical rows instead of
+# taking them from the CSV. Every (country, gas) series is laid out on one
+# (series, year, sector) array and a least squares line is fitted to all of
+# its sectors at once with closed-form sums, so the fit costs a few array
+# passes whatever the number of countries.
+#   GHG_FORECAST            off (keep the CSV's predicted rows) or linear (default off)
+#   GHG_FORECAST_WINDOW     fit only the last N historical years, 0 fits all of them (default 0)
+#   GHG_FORECAST_LAST_YEAR  last predicted year (default 2040)
+#
+# Sectors other than the ones in SIGNED_COLUMNS are clipped at 0, a land use
+# sink may stay negative. A sector without historical values in the window
+# stays empty, one with a single value is carried forward flat.
+
+FORECAST_MODEL = os.environ.get('GHG_FORECAST', 'off').lower()
+FORECAST_WINDOW = max(int(os.environ.get('GHG_FORECAST_WINDOW', '0')), 0)
+FORECAST_LAST_YEAR = int(os.environ.get('GHG_FORECAST_LAST_YEAR', '2040'))
+SERIES_KEYS = ['CountryCode', 'Gas']
+SIGNED_COLUMNS = ['LUCF']
+
+
+def forecast_enabled():
+    return FORECAST_MODEL == 'linear'
+
+
+def forecast_config():
+    """String of the settings that change the predicted rows, for data versions."""
+    return f"{FORECAST_MODEL}-window{FORECAST_WINDOW}-to{FORECAST_LAST_YEAR}"
+
+
+def fit_trends(x, grid):
+    """Least squares (slope, intercept) of every series of ``grid`` against ``x``.
+
+    ``grid`` is (series, len(x), sectors) with NaN where a year has no value;
+    each (series, sector) gets its own line from the years it has. Returns
+    (slope, intercept, count) arrays of shape (series, sectors).
+    """
+    observed = ~np.isnan(grid)
+    y = np.where(observed, grid, 0.0)
+    x = np.asarray(x, dtype=np.float64)[None, :, None]
+    count = observed.sum(axis=1)
+    sx = (observed * x).sum(axis=1)
+    sxx = (observed * x * x).sum(axis=1)
+    sy = y.sum(axis=1)
+    sxy = (y * x).sum(axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        det = count * sxx - sx * sx
+        slope = np.where(det > 0, (count * sxy - sx * sy) / np.where(det > 0, det, 1), 0.0)
+        intercept = (sy - slope * sx) / count
+    return slope, intercept, count
+
+
+def forecast_rows(df_actual, columns, last_year=FORECAST_LAST_YEAR, window=FORECAST_WINDOW):
+    """Predicted rows for the years after ``df_actual`` up to ``last_year``, with its columns and dtypes.
+
+    ``df_actual`` has the compact dtypes of the snapshot (boolean
+    ``predicted``). Rows are ordered by country, gas and year; ``columns``
+    are the sector columns fitted and every other column is repeated from
+    the series.
+    """
+    years = df_actual['Year'].to_numpy()
+    first_year = int(years.min()) if len(years) else 0
+    last_actual = int(years.max()) if len(years) else 0
+    if window:
+        first_year = max(first_year, last_actual - window + 1)
+    future = np.arange(last_actual + 1, last_year + 1)
+    if not len(years) or not len(future):
+        return df_actual.iloc[:0]
+    fitted = df_actual[years >= first_year]
+
+    # one row of the grid per series, one column per year of the window
+    series = fitted.groupby(SERIES_KEYS, observed=True, sort=True).ngroup().to_numpy()
+    n_series = int(series.max()) + 1
+    first_rows = np.unique(series, return_index=True)[1]
+    grid = np.full((n_series, last_actual - first_year + 1, len(columns)), np.nan)
+    grid[series, fitted['Year'].to_numpy() - first_year] = fitted[columns].to_numpy(dtype=np.float64)
+
+    # x is centered on the last historical year so the sums stay well conditioned
+    slope, intercept, count = fit_trends(np.arange(first_year, last_actual + 1) - last_actual, grid)
+    predicted = intercept[:, None, :] + slope[:, None, :] * (future - last_actual)[None, :, None]
+    clipped = [i for i, col in enumerate(columns) if col not in SIGNED_COLUMNS]
+    predicted[:, :, clipped] = np.maximum(predicted[:, :, clipped], 0)
+
+    rows = np.repeat(first_rows, len(future))
+    out = {}
+    for col in df_actual.columns:
+        if col == 'Year':
+            out[col] = np.tile(future, n_series).astype(df_actual[col].dtype)
+        elif col == 'predicted':
+            out[col] = np.ones(len(rows), dtype=bool)
+        elif col in columns:
+            out[col] = predicted[:, :, columns.index(col)].reshape(-1).astype(df_actual[col].dtype)
+        else:
+            # categorical id columns keep the categories of the historical rows
+            out[col] = fitted[col].take(rows).reset_index(drop=True)
+    return pd.DataFrame(out)
+
+
+def with_forecast(df_final, columns, last_year=FORECAST_LAST_YEAR, window=FORECAST_WINDOW):
+    """df_final with its predicted rows replaced by ``forecast_rows`` of its historical ones, historical rows first."""
+    t0 = time.perf_counter()
+    df_actual = df_final[~df_final['predicted']]
+    predicted = forecast_rows(df_actual, columns, last_year, window)
+    print(f"forecast: {len(predicted)} predicted rows in {time.perf_counter() - t0:.3f}s", flush=True)
+    return pd.concat([df_actual, predicted], ignore_index=True)
@@ -0,0 +1,247 @@
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+
+## PROFILING AND METRICS
+# Wraps callbacks and figure builders to record wall time, split into phases
+# (data, figure, serialize), and peak traced allocations. Off by default and
+# switchable at runtime; when off the wrappers call straight through.
+#   PROFILING=1            start with profiling on when there is no flag file
+#   PROFILING_FLAG         file holding the switch, shared by every worker on
+#                          the host (default $TMPDIR/ghg-profiling)
+#   PROFILING_TOKEN        token required by POST /metrics/profiling
+#   PROFILE_DUMP           path prefix for a rolling JSON-lines dump of every
+#                          call (one file per worker pid)
+#   PROFILE_DUMP_MAX_MB    size at which the dump rolls over (default 10)
+#
+# tracemalloc sees the whole process, so with several threads per worker a
+# call's peak also holds whatever ran beside it. The peak of a call is only
+# kept when no other profiled call overlapped it; the process-wide peak is
+# reported separately and holds every call.
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# seconds between checks of the flag file
+FLAG_POLL_INTERVAL = 1.0
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Profiler:
+    def __init__(self, enabled=False, dump_path=None, dump_max_bytes=10 * 1024 * 1024, flag_path=None):
+        self._enabled = False
+        self.stats = {}
+        self.collectors = []
+        self.process_peak_bytes = 0
+        self.flag_path = flag_path
+        self._flag_mtime = None
+        self._flag_checked = 0.0
+        self._active = 0
+        self._started = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._dump = None
+        if dump_path:
+            handler = logging.handlers.RotatingFileHandler(f"{dump_path}.{os.getpid()}", maxBytes=dump_max_bytes, backupCount=1)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._dump = logging.getLogger(f"{__name__}.dump.{id(self)}")
+            self._dump.propagate = False
+            self._dump.setLevel(logging.INFO)
+            self._dump.addHandler(handler)
+        self._apply(enabled)
+        if flag_path is not None:
+            # a flag left by a running worker wins over the start value
+            self._check_flag()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            enabled=os.environ.get('PROFILING', '0').lower() in ('1', 'true', 'yes'),
+            dump_path=os.environ.get('PROFILE_DUMP'),
+            dump_max_bytes=int(float(os.environ.get('PROFILE_DUMP_MAX_MB', '10')) * 1024 * 1024),
+            flag_path=os.environ.get('PROFILING_FLAG', os.path.join(tempfile.gettempdir(), 'ghg-profiling')))
+
+    @property
+    def enabled(self):
+        if self.flag_path is not None and time.monotonic() - self._flag_checked > FLAG_POLL_INTERVAL:
+            self._check_flag()
+        return self._enabled
+
+    def _apply(self, enabled):
+        with self._lock:
+            if enabled and not tracemalloc.is_tracing():
+                tracemalloc.start()
+            elif not enabled and tracemalloc.is_tracing():
+                self._update_process_peak()
+                tracemalloc.stop()
+            self._enabled = enabled
+
+    def _check_flag(self):
+        self._flag_checked = time.monotonic()
+        try:
+            mtime = os.stat(self.flag_path).st_mtime_ns
+            if mtime == self._flag_mtime:
+                return
+            with open(self.flag_path) as f:
+                enabled = f.read().strip() == '1'
+        except OSError:
+            return
+        self._flag_mtime = mtime
+        if enabled != self._enabled:
+            self._apply(enabled)
+
+    def set_enabled(self, enabled):
+        """Switch profiling in this worker and, through the flag file, in the others on the host."""
+        enabled = bool(enabled)
+        if self.flag_path is not None:
+            directory = os.path.dirname(os.path.abspath(self.flag_path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ghg-profiling-')
+            with os.fdopen(fd, 'w') as f:
+                f.write('1' if enabled else '0')
+            os.replace(tmp_path, self.flag_path)
+        self._apply(enabled)
+
+    def _update_process_peak(self):
+        # called with self._lock held, before anything resets the traced peak
+        if tracemalloc.is_tracing():
+            self.process_peak_bytes = max(self.process_peak_bytes, tracemalloc.get_traced_memory()[1])
+
+    def _start_measure(self):
+        with self._lock:
+            alone = self._active == 0
+            self._active += 1
+            self._started += 1
+            if alone and tracemalloc.is_tracing():
+                self._update_process_peak()
+                tracemalloc.reset_peak()
+            return alone, self._started, tracemalloc.get_traced_memory()[0]
+
+    def _end_measure(self, alone, started, base):
+        """Peak bytes of a call measured from ``_start_measure``, None if another call overlapped it."""
+        with self._lock:
+            self._active -= 1
+            if not (alone and started == self._started and tracemalloc.is_tracing()):
+                return None
+            return max(tracemalloc.get_traced_memory()[1] - base, 0)
+
+    def add_collector(self, collector):
+        """Register a function returning extra Prometheus text lines for /metrics."""
+        self.collectors.append(collector)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        record = getattr(self._local, 'record', None)
+        if record is None:
+            yield
+            return
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['phases'][name] = record['phases'].get(name, 0.0) + time.perf_counter() - t0
+
+    def instrument(self, name, measure_serialization=False):
+        """Record every call of the wrapped function under ``name`` while profiling is on.
+
+        With ``measure_serialization`` the result is JSON-encoded once more to
+        time the serialize phase if nothing inside the call recorded it.
+        """
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                # Nested calls (a builder run inside a callback) get their own
+                # record; only the outermost call measures allocations.
+                parent = getattr(self._local, 'record', None)
+                record = {'phases': {}}
+                self._local.record = record
+                measure = self._start_measure() if parent is None else None
+                t0 = time.perf_counter()
+                try:
+                    result = func(*args, **kwargs)
+                    if measure_serialization and 'serialize' not in record['phases']:
+                        from payload import serialize
+                        serialize(name, result)
+                    return result
+                finally:
+                    elapsed = time.perf_counter() - t0
+                    peak = self._end_measure(*measure) if measure is not None else None
+                    self._local.record = parent
+                    self.record(name, elapsed, record['phases'], peak)
+            return wrapper
+        return decorator
+
+    def record(self, name, elapsed, phases, peak_bytes):
+        with self._lock:
+            stat = self.stats.setdefault(name, {
+                'count': 0, 'seconds': 0.0, 'phases': {}, 'peak_bytes_max': 0, 'peak_samples': 0,
+                'buckets': [0] * len(BUCKETS)})
+            stat['count'] += 1
+            stat['seconds'] += elapsed
+            for phase, seconds in phases.items():
+                stat['phases'][phase] = stat['phases'].get(phase, 0.0) + seconds
+            if peak_bytes is not None:
+                stat['peak_bytes_max'] = max(stat['peak_bytes_max'], peak_bytes)
+                stat['peak_samples'] += 1
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    stat['buckets'][i] += 1
+        if self._dump is not None:
+            self._dump.info(json.dumps({
+                'ts': time.time(), 'pid': os.getpid(), 'name': name, 'seconds': elapsed,
+                'phases': phases, 'peak_bytes': peak_bytes}))
+
+    def prometheus_text(self):
+        pid = os.getpid()
+        lines = [
+            '# HELP ghg_profiling_enabled Whether callback profiling is on in this worker.',
+            '# TYPE ghg_profiling_enabled gauge',
+            f'ghg_profiling_enabled{{pid="{pid}"}} {int(self.enabled)}',
+            '# HELP ghg_call_seconds Wall time of profiled callbacks and figure builders.',
+            '# TYPE ghg_call_seconds histogram',
+        ]
+        with self._lock:
+            stats = {name: dict(stat, phases=dict(stat['phases']), buckets=list(stat['buckets']))
+                     for name, stat in self.stats.items()}
+            self._update_process_peak()
+            process_peak = self.process_peak_bytes
+        for name, stat in sorted(stats.items()):
+            labels = f'name="{_escape(name)}",pid="{pid}"'
+            for bound, count in zip(BUCKETS, stat['buckets']):
+                lines.append(f'ghg_call_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'ghg_call_seconds_bucket{{{labels},le="+Inf"}} {stat["count"]}')
+            lines.append(f'ghg_call_seconds_sum{{{labels}}} {stat["seconds"]}')
+            lines.append(f'ghg_call_seconds_count{{{labels}}} {stat["count"]}')
+        lines += ['# HELP ghg_call_phase_seconds_total Wall time spent per phase of profiled calls.',
+                  '# TYPE ghg_call_phase_seconds_total counter']
+        for name, stat in sorted(stats.items()):
+            for phase, seconds in sorted(stat['phases'].items()):
+                lines.append(f'ghg_call_phase_seconds_total{{name="{_escape(name)}",phase="{_escape(phase)}",pid="{pid}"}} {seconds}')
+        lines += ['# HELP ghg_call_peak_bytes Largest traced allocation peak of a single call that ran alone.',
+                  '# TYPE ghg_call_peak_bytes gauge']
+        for name, stat in sorted(stats.items()):
+            lines.append(f'ghg_call_peak_bytes{{name="{_escape(name)}",pid="{pid}"}} {stat["peak_bytes_max"]}')
+        lines += ['# HELP ghg_call_peak_samples_total Calls whose allocation peak was measured, no other call overlapping.',
+                  '# TYPE ghg_call_peak_samples_total counter']
+        for name, stat in sorted(stats.items()):
+            lines.append(f'ghg_call_peak_samples_total{{name="{_escape(name)}",pid="{pid}"}} {stat["peak_samples"]}')
+        lines += ['# HELP ghg_process_peak_traced_bytes Largest traced allocations of this worker while profiling was on.',
+                  '# TYPE ghg_process_peak_traced_bytes gauge',
+                  f'ghg_process_peak_traced_bytes{{pid="{pid}"}} {process_peak}']
+        for collector in self.collectors:
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+profiler = Profiler.from_env()
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+
+import numpy as np
+from plotly.utils import PlotlyJSONEncoder
+
+from metrics import profiler
+
+
+## PAYLOAD BUDGET
+# Optional mode that trims what the callbacks send to the browser:
+#   PAYLOAD_BUDGET=1          turn the mode on
+#   PAYLOAD_DIGITS            significant digits kept in numeric arrays (default 4)
+#   SUNBURST_MAX_NODES        node cap for the sector sunburst (default 600)
+#   SUNBURST_MIN_SHARE        sectors under this share of their gas are merged
+#                             into "Other" (default 0.02)
+# Serialized size and time of every figure are measured regardless of the
+# mode and of the figure cache backend, and printed when PAYLOAD_LOG=1.
+
+PAYLOAD_BUDGET = os.environ.get('PAYLOAD_BUDGET', '0').lower() in ('1', 'true', 'yes')
+PAYLOAD_DIGITS = int(os.environ.get('PAYLOAD_DIGITS', '4'))
+SUNBURST_MAX_NODES = int(os.environ.get('SUNBURST_MAX_NODES', '600'))
+SUNBURST_MIN_SHARE = float(os.environ.get('SUNBURST_MIN_SHARE', '0.02'))
+PAYLOAD_LOG = os.environ.get('PAYLOAD_LOG', '0').lower() in ('1', 'true', 'yes')
+
+
+def payload_config():
+    """String of the settings that change the trimmed figures, for figure cache keys."""
+    if not PAYLOAD_BUDGET:
+        return "full"
+    return f"budget-digits{PAYLOAD_DIGITS}-nodes{SUNBURST_MAX_NODES}-share{SUNBURST_MIN_SHARE}"
+
+
+payload_stats = {}
+_stats_lock = threading.Lock()
+
+
+def round_significant(values, digits=PAYLOAD_DIGITS):
+    """Round a float array to ``digits`` significant digits so it serializes shorter."""
+    values = np.asarray(values, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        magnitude = np.floor(np.log10(np.abs(values)))
+    magnitude = np.where(np.isfinite(magnitude), magnitude, 0)
+    scale = 10.0 ** (digits - 1 - magnitude)
+    return np.round(values * scale) / scale
+
+
+def collapse_small(df, path, value, min_share=SUNBURST_MIN_SHARE, other='Other'):
+    """Merge leaves under ``min_share`` of their parent's total into one ``other`` leaf."""
+    parents = path[:-1]
+    leaf = path[-1]
+    totals = df.groupby(parents, sort=False)[value].transform('sum')
+    small = df[value] < totals * min_share
+    if not small.any():
+        return df
+    df = df.copy()
+    df.loc[small, leaf] = other
+    return df.groupby(path, sort=False, as_index=False)[value].sum()
+
+
+def cap_nodes(df, path, value, max_nodes=SUNBURST_MAX_NODES):
+    """Drop the deepest path levels until the hierarchy has at most ``max_nodes`` nodes."""
+    while len(path) > 1:
+        nodes = sum(df[path[:depth]].drop_duplicates().shape[0] for depth in range(1, len(path) + 1))
+        if nodes <= max_nodes:
+            break
+        path = path[:-1]
+        df = df.groupby(path, sort=False, as_index=False)[value].sum()
+    return df, path
+
+
+def record_payload(name, size, serialize_s=None, source='built'):
+    """Keep the size (and encode time, when it was encoded) of ``name``'s last result, printed when PAYLOAD_LOG=1."""
+    with _stats_lock:
+        stat = payload_stats.setdefault(name, {'bytes': 0, 'serialize_s': 0.0, 'count': 0})
+        stat['bytes'] = size
+        stat['count'] += 1
+        if serialize_s is not None:
+            stat['serialize_s'] = serialize_s
+    if PAYLOAD_LOG:
+        timing = f" serialized in {serialize_s * 1000:.1f} ms" if serialize_s is not None else f" from {source}"
+        print(f"payload {name}: {size / 1024:.1f} KB{timing}")
+
+
+def serialize(name, result):
+    """JSON-encode a callback result, recording its size and encode time under ``name``."""
+    t0 = time.perf_counter()
+    with profiler.phase('serialize'):
+        serialized = json.dumps(result, cls=PlotlyJSONEncoder)
+    record_payload(name, len(serialized), time.perf_counter() - t0)
+    return serialized
@@ -0,0 +1,131 @@
+import os
+
+import numpy as np
+import plotly.graph_objects as go
+
+
+## RACEPLOT FRAMES
+# Bar chart race built straight from per-year country totals: every frame's
+# top N is found with one partial sort over the whole (country x frame) grid
+# and only those bars are emitted.
+#   RACEPLOT_TOP_N     bars per frame (default 10)
+#   RACEPLOT_STRIDE    keep every Nth year, the last year is always kept (default 1)
+#   RACEPLOT_STEPS     interpolated frames between two kept years (default 0)
+
+RACEPLOT_TOP_N = int(os.environ.get('RACEPLOT_TOP_N', '10'))
+RACEPLOT_STRIDE = max(int(os.environ.get('RACEPLOT_STRIDE', '1')), 1)
+RACEPLOT_STEPS = max(int(os.environ.get('RACEPLOT_STEPS', '0')), 0)
+
+
+def race_config():
+    """String of the settings that change the frames, for artifact versions."""
+    return f"top{RACEPLOT_TOP_N}-stride{RACEPLOT_STRIDE}-steps{RACEPLOT_STEPS}"
+
+
+def race_frames(years, values, present, n=RACEPLOT_TOP_N, stride=RACEPLOT_STRIDE, steps=RACEPLOT_STEPS):
+    """Top ``n`` items of every frame, smallest first as the bars are drawn.
+
+    ``values`` and ``present`` are (items, years) arrays; items without rows
+    in a year are left out of it, and years without any rows get no frame.
+    Returns (labels, is_key_frame, rows, values) where ``rows`` indexes the
+    items and both are lists with one array per frame.
+    """
+    keep = np.flatnonzero(present.any(axis=0))
+    if len(keep) == 0:
+        return [], [], [], []
+    keep = np.union1d(keep[::stride], keep[-1:])
+    values = np.where(present[:, keep], values[:, keep], np.nan)
+    years = np.asarray(years)[keep]
+
+    labels = [str(years[0])]
+    key_frame = [True]
+    columns = [values[:, :1]]
+    if steps and len(keep) > 1:
+        # linear steps between consecutive kept years; a missing end counts as 0
+        lo, hi = values[:, :-1], values[:, 1:]
+        both_missing = np.isnan(lo) & np.isnan(hi)
+        lo, hi = np.nan_to_num(lo), np.nan_to_num(hi)
+        t = np.arange(1, steps + 1) / (steps + 1)
+        between = lo[:, :, None] + (hi - lo)[:, :, None] * t
+        between[both_missing] = np.nan
+        for i, year in enumerate(years[1:]):
+            columns += [between[:, i, :], values[:, i + 1:i + 2]]
+            labels += [f"{years[i]}+{k}/{steps + 1}" for k in range(1, steps + 1)] + [str(year)]
+            key_frame += [False] * steps + [True]
+    else:
+        columns.append(values[:, 1:])
+        labels += [str(year) for year in years[1:]]
+        key_frame += [True] * (len(years) - 1)
+    grid = np.concatenate(columns, axis=1)
+
+    n = min(n, grid.shape[0])
+    ranked = np.where(np.isnan(grid), -np.inf, grid)
+    top = np.argpartition(-ranked, n - 1, axis=0)[:n]
+    top_values = np.take_along_axis(ranked, top, axis=0)
+    order = np.argsort(top_values, axis=0, kind='stable')
+    top = np.take_along_axis(top, order, axis=0)
+    top_values = np.take_along_axis(top_values, order, axis=0)
+
+    rows, frame_values = [], []
+    for f in range(grid.shape[1]):
+        valid = np.isfinite(top_values[:, f])
+        rows.append(top[valid, f])
+        frame_values.append(top_values[valid, f])
+    return labels, key_frame, rows, frame_values
+
+
+def item_colors(n_items, seed=0):
+    rng = np.random.default_rng(seed)
+    return [f"rgb({r}, {g}, {b})" for r, g, b in rng.integers(0, 256, (n_items, 3))]
+
+
+def race_figure(frames, items, colors, item_label=None, value_label=None, time_label='Date: ', frame_duration=500):
+    """Horizontal bar chart race figure, laid out as raceplotly's barplot, from ``race_frames`` output."""
+    labels, key_frame, rows, values = frames
+    items = np.asarray(items, dtype=object)
+    colors = np.asarray(colors, dtype=object)
+    max_value = max((v.max() for v in values if len(v)), default=0)
+    # interpolated frames share the time of a year between them
+    step_duration = frame_duration * max(sum(key_frame), 1) / max(len(labels), 1)
+
+    def bars(f, **extra):
+        return dict(type='bar', x=values[f].tolist(), y=items[rows[f]].tolist(),
+                    marker=dict(color=colors[rows[f]].tolist()), cliponaxis=False, hoverinfo='all',
+                    textposition='outside', texttemplate='%{y}<br>%{x:.4s}', textangle=0, orientation='h', **extra)
+
+    frame_layout = dict(font=dict(size=14), plot_bgcolor='#FFFFFF',
+                        xaxis=dict(showline=True, visible=True, range=[0, max_value]),
+                        yaxis=dict(showline=False, visible=True), bargap=0.15)
+    fig = go.Figure(
+        data=[bars(0)] if labels else [],
+        layout=dict(frame_layout,
+                    xaxis=dict(showline=True, visible=True, range=[0, max_value], title_text=value_label, showticklabels=True),
+                    yaxis=dict(showline=False, visible=True, title_text=item_label, showticklabels=False)))
+
+    fig.update_layout(
+        updatemenus=[dict(
+            buttons=[
+                dict(args=[None, {"frame": {"duration": step_duration, "redraw": False}, "fromcurrent": True,
+                                  "transition": {"duration": step_duration, "easing": "quadratic-in-out"}}],
+                     label="Play", method="animate"),
+                dict(args=[[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate",
+                                    "transition": {"duration": 0}}],
+                     label="Pause", method="animate"),
+            ],
+            direction="left", pad={"r": 10, "t": 87}, showactive=True, type="buttons",
+            x=0.1, xanchor="right", y=0, yanchor="top")],
+        sliders=[dict(
+            active=0, yanchor="top", xanchor="left",
+            currentvalue={"font": {"size": 20}, "prefix": time_label, "visible": True, "xanchor": "right"},
+            transition={"duration": 300, "easing": "cubic-in-out"},
+            pad={"b": 10, "t": 50}, len=0.9, x=0.1, y=0,
+            steps=[{"args": [[label], {"frame": {"duration": frame_duration, "redraw": False}, "mode": "immediate",
+                                       "transition": {"duration": frame_duration}}],
+                    "label": label, "method": "animate"}
+                   for label, key in zip(labels, key_frame) if key])])
+
+    # Frames stay plain dicts, validating thousands of bars through go.Frame is the slow part
+    figure = fig.to_plotly_json()
+    figure['frames'] = [dict(data=[bars(f, hovertemplate='<extra></extra>')], layout=frame_layout, name=label)
+                        for f, label in enumerate(labels)]
+    return figure
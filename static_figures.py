@@ -0,0 +1,199 @@
+import fcntl
+import hashlib
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from payload import serialize
+
+
+## STATIC FIGURES
+# Figures that only depend on the data (area graphs, raceplot, treemap, red/grey
+# sunburst) are built the first time a page asks for them instead of at import.
+# The serialized figure is kept in memory and written to an artifact keyed by
+# the data version so other workers, and later boots, load it instead of
+# rebuilding. Once a data version is live, the artifacts of every other
+# version are deleted, so hot reloads do not fill the disk.
+#
+# With FIGURE_WORKERS > 1 the figures are instead precomputed together when
+# the data is loaded: each missing figure is built in a forked process and
+# comes back as serialized JSON, and a file lock lets one gunicorn worker per
+# host do the building while the others wait for the artifacts.
+
+# Bump when a builder changes so stale artifacts are ignored.
+STATIC_FIGURES_VERSION = 2
+FIGURE_WORKERS = int(os.environ.get('FIGURE_WORKERS', '0'))
+
+# Stores being precomputed; a forked child finds its builder here, so only
+# the store and figure names are sent to it.
+_PRECOMPUTING = {}
+
+
+def _build_serialized(store_id, name):
+    t0 = time.perf_counter()
+    figure = _PRECOMPUTING[store_id].builders[name]()
+    return serialize(name, figure), time.perf_counter() - t0
+
+
+def available_cpus():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def precompute(requests, workers=FIGURE_WORKERS):
+    """Build or load every (store, name) in ``requests``, building the missing ones ``workers`` at a time.
+
+    ``workers`` is capped at the available CPUs. Figures are built in forked
+    processes, which is only safe while this is the only thread; otherwise
+    (e.g. during a background data reload) they are built on a thread pool.
+    """
+    requests = [(store, name) for store, name in requests if name not in store._figures]
+    workers = min(workers, available_cpus())
+    if workers > 1 and len(requests) > 1:
+        artifact_dir = next((store.artifact_dir for store, _ in requests if store.artifact_dir), None)
+        lock_file = None
+        if artifact_dir is not None:
+            os.makedirs(artifact_dir, exist_ok=True)
+            lock_file = open(os.path.join(artifact_dir, '.precompute.lock'), 'w')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            missing = [(store, name) for store, name in requests if store._read_artifact(name) is None]
+            if len(missing) > 1:
+                _build_in_pool(missing, workers)
+        finally:
+            if lock_file is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+                lock_file.close()
+    for store, name in requests:
+        store.get(name)
+
+
+def _build_in_pool(missing, workers):
+    fork = threading.active_count() == 1 and 'fork' in multiprocessing.get_all_start_methods()
+    for store, _ in missing:
+        _PRECOMPUTING[id(store)] = store
+    try:
+        t0 = time.perf_counter()
+        if fork:
+            pool = ProcessPoolExecutor(min(workers, len(missing)), mp_context=multiprocessing.get_context('fork'))
+        else:
+            pool = ThreadPoolExecutor(min(workers, len(missing)))
+        with pool:
+            futures = [(store, name, pool.submit(_build_serialized, id(store), name)) for store, name in missing]
+            for store, name, future in futures:
+                serialized, build_time = future.result()
+                store._add(name, serialized, 'built', build_time, time.perf_counter() - t0)
+    finally:
+        for store, _ in missing:
+            _PRECOMPUTING.pop(id(store), None)
+
+
+def remove_stale_artifacts(stores):
+    """Delete the artifacts in the directories of ``stores`` that are of none of their versions; return how many."""
+    versions = {}
+    for store in stores:
+        if store.artifact_dir is not None:
+            versions.setdefault(store.artifact_dir, set()).add(store.version)
+    removed = 0
+    for directory, keep in versions.items():
+        try:
+            with os.scandir(directory) as it:
+                # {name}-{version}.json; names may hold dashes, versions do not
+                stale = [entry.path for entry in it if entry.name.endswith('.json')
+                         and entry.name[:-len('.json')].rsplit('-', 1)[-1] not in keep]
+        except OSError:
+            continue
+        for path in stale:
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                # another worker removed it first
+                pass
+    return removed
+
+
+class StaticFigureStore:
+    def __init__(self, builders, data_version, artifact_dir=None):
+        self.builders = builders
+        self.version = hashlib.sha256(f"{STATIC_FIGURES_VERSION}-{data_version}".encode()).hexdigest()[:16]
+        self.artifact_dir = artifact_dir
+        self.timings = {}
+        self._figures = {}
+        self._locks = {name: threading.Lock() for name in builders}
+
+    def _artifact_path(self, name):
+        return os.path.join(self.artifact_dir, f"{name}-{self.version}.json")
+
+    def _read_artifact(self, name):
+        if self.artifact_dir is None:
+            return None
+        try:
+            with open(self._artifact_path(name), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def _write_artifact(self, name, serialized):
+        if self.artifact_dir is None:
+            return
+        try:
+            os.makedirs(self.artifact_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.artifact_dir, suffix='.tmp')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(serialized)
+            os.replace(tmp_path, self._artifact_path(name))
+        except OSError as e:
+            print(f"Could not write figure artifact for {name}: {e}")
+
+    def _add(self, name, serialized, source, build_time, total_time):
+        if source == 'built':
+            self._write_artifact(name, serialized)
+        figure = json.loads(serialized)
+        self.timings[name] = {
+            'source': source,
+            'build_s': build_time,
+            'total_s': total_time,
+            'bytes': len(serialized),
+        }
+        print(f"static figure {name}: {source} in {total_time:.3f}s, {len(serialized) / 1024:.0f} KB")
+        self._figures[name] = figure
+        return figure
+
+    def get(self, name):
+        """Return the figure as a plain dict, building it on first use."""
+        figure = self._figures.get(name)
+        if figure is not None:
+            return figure
+        with self._locks[name]:
+            figure = self._figures.get(name)
+            if figure is not None:
+                return figure
+
+            t0 = time.perf_counter()
+            serialized = self._read_artifact(name)
+            source = 'artifact'
+            build_time = 0.0
+            if serialized is None:
+                source = 'built'
+                figure = self.builders[name]()
+                build_time = time.perf_counter() - t0
+                serialized = serialize(name, figure)
+            return self._add(name, serialized, source, build_time, time.perf_counter() - t0)
+
+    def precompute(self, workers=FIGURE_WORKERS):
+        precompute([(self, name) for name in self.builders], workers)
+        return self.timings
+
+    def report(self):
+        width = max([22] + [len(name) + 2 for name in self.timings])
+        lines = [f"{'figure':<{width}}{'source':<10}{'build s':>10}{'total s':>10}{'KB':>10}"]
+        for name, t in self.timings.items():
+            lines.append(f"{name:<{width}}{t['source']:<10}{t['build_s']:>10.3f}{t['total_s']:>10.3f}{t['bytes'] / 1024:>10.0f}")
+        return "\n".join(lines)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from data_loader import SORT_KEYS, compact_dtypes  # noqa: E402
+import synthetic_data  # noqa: E402
+
+N_COUNTRIES = 12
+
+
+@pytest.fixture(scope='session')
+def df_csv():
+    """df_final as read_csv would parse the synthetic CSV."""
+    return synthetic_data.generate(n_countries=N_COUNTRIES)[0]
+
+
+@pytest.fixture(scope='session')
+def df_final(df_csv):
+    """df_final as the app holds it: compact dtypes, historical rows first."""
+    return compact_dtypes(df_csv).sort_values(SORT_KEYS['df_final.csv'], kind='stable', ignore_index=True)
+
+
+@pytest.fixture(scope='session')
+def data_dir(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp('data'))
+    synthetic_data.write(directory, n_countries=N_COUNTRIES)
+    return directory
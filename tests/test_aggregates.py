@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from aggregates import (SECTOR_EXCLUDED_COLUMNS, SECTOR_ID_COLUMNS, EmissionsCube, RollupStore, SeriesIndex,
+                        appended_rows, hierarchy)
+from bench_choropleth_cube import groupby_path, slider_ranges
+
+
+@pytest.fixture(scope='module')
+def sectors(df_final):
+    return [col for col in df_final.columns if col not in SECTOR_ID_COLUMNS + SECTOR_EXCLUDED_COLUMNS]
+
+
+def test_range_mean_matches_groupby_for_every_slider_range(df_csv, df_final):
+    cube = EmissionsCube(df_final, value_columns=['allsectors', 'transport'])
+    for gas in df_csv['Gas'].unique():
+        for start, end in slider_ranges():
+            expected = groupby_path(df_csv, gas, start, end)
+            got = cube.range_mean(gas, start, end)
+            assert got['CountryName'].tolist() == expected['CountryName'].tolist()
+            assert got['CountryCode'].tolist() == expected['CountryCode'].tolist()
+            for col in ['allsectors', 'transport']:
+                np.testing.assert_allclose(got[col].to_numpy(), expected[col].to_numpy(), rtol=1e-12, atol=0,
+                                           equal_nan=True, err_msg=f"{gas} {start}-{end} {col}")
+
+
+def test_range_mean_outside_the_data_is_empty(df_final):
+    cube = EmissionsCube(df_final)
+    assert cube.range_mean('GHG', 1960, 1980).empty
+    assert cube.range_mean('no such gas', 1990, 2000).empty
+
+
+def test_hierarchy_parents_are_the_sum_of_their_children(df_final, sectors):
+    rollup = RollupStore(df_final, sectors + ['allsectors'])
+    path = ['Region', 'CountryName', 'Gas', 'Sector']
+    leaves = rollup.leaves(sectors, country_codes=['USA', 'CHN', 'IND', 'X011'], start=1994, end=2030)
+    ids, labels, parents, values = hierarchy(leaves, path, 'Emissions', root='world')
+
+    assert len(set(ids)) == len(ids)
+    children = pd.Series(values, index=parents).groupby(level=0).sum()
+    totals = dict(zip(ids, values))
+    for parent, total in children.items():
+        if parent:
+            assert totals[parent] == pytest.approx(total, rel=1e-12)
+    assert totals['world'] == pytest.approx(leaves['Emissions'].sum(), rel=1e-12)
+    assert set(parents) - {''} <= set(ids)
+    leaf_ids = set(ids) - set(parents)
+    assert len(leaf_ids) == len(leaves)
+
+
+def test_series_index_rows_are_the_key_and_year_bounds(df_final):
+    index = SeriesIndex(df_final[['CountryCode', 'Gas', 'predicted', 'Year', 'allsectors']], ['CountryCode', 'Gas'])
+    frame = index.frame
+    keys = [('USA', 'GHG'), ('X011', 'methane(CH4)'), ('FRA', 'Nitrous oxide(N2O)')]
+    ranges = [(None, None), (1990, 2040), (1960, 1970), (2041, 2050), (2000, 2000), (2010, 2005), (None, 2001), (2030, None)]
+    for key in keys:
+        for start, end in ranges:
+            rows = frame.iloc[index.rows(key, start, end)]
+            mask = (frame['CountryCode'] == key[0]) & (frame['Gas'] == key[1])
+            if start is not None:
+                mask &= frame['Year'] >= start
+            if end is not None:
+                mask &= frame['Year'] <= end
+            assert rows.index.tolist() == frame.index[mask].tolist(), (key, start, end)
+    assert index.rows(('ZZZ', 'GHG')) == slice(0, 0)
+
+
+def assert_same_cube(got, expected):
+    assert got.countries.equals(expected.countries)
+    assert (got.first_year, got.last_year) == (expected.first_year, expected.last_year)
+    assert list(got.gases) == list(expected.gases)
+    for gas, prefix in expected.gases.items():
+        assert list(got.gases[gas]) == list(prefix)
+        for key, arrays in prefix.items():
+            pairs = zip(got.gases[gas][key], arrays) if isinstance(arrays, tuple) else [(got.gases[gas][key], arrays)]
+            for a, b in pairs:
+                assert a.dtype == b.dtype
+                np.testing.assert_array_equal(a, b, err_msg=f"{gas} {key}")
+
+
+def test_appended_cube_matches_a_rebuilt_one(df_final):
+    # X011 only has rows from 2005 on, so the second append adds a country
+    df = df_final[(df_final['CountryCode'] != 'X011') | (df_final['Year'] >= 2005)]
+    cube = EmissionsCube(df[df['Year'] < 2000], value_columns=['allsectors', 'LUCF'])
+    cube.append(df[(df['Year'] >= 2000) & (df['Year'] <= 2018)])
+    cube.append(df[df['Year'] > 2018])
+    assert_same_cube(cube, EmissionsCube(df, value_columns=['allsectors', 'LUCF']))
+    with pytest.raises(ValueError):
+        cube.append(df[df['Year'] == 2040])
+
+
+@pytest.mark.parametrize('overlap', [False, True])
+def test_extended_rollup_matches_a_rebuilt_one(df_final, sectors, overlap):
+    df = df_final.copy()
+    if overlap:
+        # predicted rows before the last historical year give the historical rows a cube of their own
+        df.loc[(df['CountryCode'] == 'X011') & (df['Year'] >= 2010), 'predicted'] = True
+    columns = sectors + ['allsectors']
+    previous_df = df[df['Year'] <= 2030]
+    previous = RollupStore(previous_df, columns)
+    rows = appended_rows(previous_df, df)
+    assert rows is not None and (rows['Year'] > 2030).all() and len(rows) + len(previous_df) == len(df)
+
+    extended = previous.extended(df, rows)
+    rebuilt = RollupStore(df, columns)
+    assert_same_cube(extended.cube, rebuilt.cube)
+    assert_same_cube(extended.actual, rebuilt.actual)
+    assert (extended.actual is extended.cube) == (rebuilt.actual is rebuilt.cube) == (not overlap)
+    assert extended.actual_end == rebuilt.actual_end
+    assert extended.positions == rebuilt.positions
+    assert extended.regions.tolist() == rebuilt.regions.tolist()
+    pd.testing.assert_frame_equal(extended.leaves(sectors, start=2000, end=2040), rebuilt.leaves(sectors, start=2000, end=2040))
+    # the previous store is left as it was
+    assert previous.cube.last_year == 2030
+    assert_same_cube(previous.cube, RollupStore(previous_df, columns).cube)
+
+
+def test_appended_rows_only_takes_later_years(df_final):
+    previous = df_final[df_final['Year'] <= 2030]
+    assert appended_rows(previous, df_final[df_final['Year'] <= 2030]).empty
+
+    changed = df_final.copy()
+    changed.loc[changed['Year'] == 2000, 'transport'] += 1
+    assert appended_rows(previous, changed) is None
+    assert appended_rows(previous, df_final.drop(columns=['transport'])) is None
+    assert appended_rows(previous, df_final[df_final['Year'] != 1995]) is None
@@ -0,0 +1,50 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(data_dir, tmp_path_factory):
+    os.environ.update(GHG_DATA_DIR=data_dir, GHG_SNAPSHOT_DIR=str(tmp_path_factory.mktemp('snapshot')))
+    import app
+    return app.server.test_client()
+
+
+def post(client, body, content_type):
+    return client.post('/api/carbon-footprint', data=body, content_type=content_type)
+
+
+def test_bulk_scores_json_rows(client):
+    response = post(client, json.dumps({'rows': [{'id': 1, 'electricity_bill': 100, 'recycle_paper': 'Yes'}]}),
+                    'application/json')
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True).splitlines()[0]) == {
+        'id': 1, 'footprint': 100 * 105 + 166.0, 'indicator': 100 * 105 + 166.0, 'invalid_fields': 0}
+
+
+@pytest.mark.parametrize('body, content_type', [
+    ('{"rows": [', 'application/json'),
+    ('{"rows": {"electricity_bill": 1}}', 'application/json'),
+    ('[{"electricity_bill": 1}, 2]', 'application/json'),
+    (b'\xff\xfe[]', 'application/json'),
+    ('{"electricity_bill": 1}\n{"gas_bill": \n', 'application/x-ndjson'),
+    ('[1, 2]\n', 'application/x-ndjson'),
+    ('electricity_bill,gas_bill\n1,2\n3,4,5,6\n', 'text/csv'),
+    (b'electricity_bill\n\xff\xfe\n', 'text/csv'),
+    (b'{"gas_bill": 1}\n{"gas_bill": "\xff"}\n', 'application/x-ndjson'),
+    ('electricity,gas\n1,2\n', 'text/csv'),
+    ('[{"electricity": 1}]', 'application/json'),
+])
+def test_bulk_rejects_unreadable_bodies(client, body, content_type):
+    response = post(client, body, content_type)
+    assert response.status_code == 400
+    assert response.mimetype == 'text/plain'
+    assert response.get_data(as_text=True).strip()
+
+
+def test_bulk_names_ignored_fields(client):
+    response = post(client, 'electricity_bill,gas,id\n1,2,3\n', 'text/csv')
+    assert response.status_code == 200
+    assert response.headers['X-Ignored-Fields'] == 'gas'
+    assert 'X-Ignored-Fields' not in post(client, 'electricity_bill,id\n1,3\n', 'text/csv').headers
@@ -0,0 +1,77 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import carbon_footprint
+from carbon_footprint import FIELDS, BulkInputError, score_households, stream_scores
+
+
+def calculator(electricity_bill, gas_bill, oil_bill, mileage, flights_short, flights_long, recycle_paper, recycle_metal):
+    # the single-household formula the dashboard has always used
+    cp = 0.0
+    cp += (electricity_bill + gas_bill) * 105
+    cp += oil_bill * 113
+    cp += mileage * 0.79
+    cp += flights_short * 1100
+    cp += flights_long * 4400
+    if recycle_paper == 'No':
+        cp += 184
+    if recycle_metal == 'No':
+        cp += 166
+    return cp
+
+
+def households(n, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n):
+        rows.append({
+            'electricity_bill': round(float(rng.gamma(2.0, 50.0)), 2), 'gas_bill': round(float(rng.gamma(2.0, 50.0)), 2),
+            'oil_bill': round(float(rng.gamma(1.0, 20.0)), 2), 'mileage': float(rng.integers(0, 30000)),
+            'flights_short': int(rng.poisson(2)), 'flights_long': int(rng.poisson(1)),
+            'recycle_paper': str(rng.choice(['Yes', 'No'])), 'recycle_metal': str(rng.choice(['Yes', 'No'])),
+        })
+    return rows
+
+
+def test_score_households_matches_the_calculator():
+    rows = households(2000)
+    columns = {field: [row[field] for row in rows] for field in FIELDS}
+    footprint, invalid = score_households(columns)
+    expected = np.array([calculator(**row) for row in rows])
+    np.testing.assert_array_equal(footprint, expected)
+    assert not invalid.any()
+
+
+def test_score_households_counts_unusable_fields():
+    footprint, invalid = score_households({'electricity_bill': [100, -5, 'abc', None, ''], 'recycle_paper': ['Yes'] * 5})
+    np.testing.assert_array_equal(invalid, [0, 1, 1, 0, 0])
+    np.testing.assert_array_equal(footprint, [100 * 105 + 166] + [166] * 4)
+
+
+def test_stream_scores_csv_matches_the_calculator():
+    rows = households(50, seed=1)
+    body = pd.DataFrame(rows).to_csv(index=False).encode()
+    out = pd.read_csv(io.StringIO(''.join(stream_scores(io.BytesIO(body), 'text/csv')[0])))
+    # read_csv's float parser may be an ulp off the decimal text
+    np.testing.assert_allclose(out['footprint'].to_numpy(), [calculator(**row) for row in rows], rtol=1e-15)
+    assert (out['invalid_fields'] == 0).all()
+
+
+def test_stream_scores_ends_with_an_error_line_after_the_first_chunk(monkeypatch):
+    monkeypatch.setattr(carbon_footprint, 'CHUNK_ROWS', 10)
+    # past the first block TextIOWrapper decodes, so the first chunk is scored before the bad bytes are read
+    body = b'{"electricity_bill": 1}\n' * 2000 + b'{"gas_bill": "\xff"}\n'
+    lines, ignored = stream_scores(io.BytesIO(body), 'application/x-ndjson')
+    out = ''.join(lines).splitlines()
+    assert ignored == []
+    assert json.loads(out[0])['footprint'] == 105 + 184 + 166
+    assert 'invalid UTF-8' in json.loads(out[-1])['error']
+
+
+def test_stream_scores_rejects_rows_without_known_fields():
+    with pytest.raises(BulkInputError, match='electricity'):
+        stream_scores(io.BytesIO(b'electricity,gas\n1,2\n'), 'text/csv')
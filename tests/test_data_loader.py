@@ -0,0 +1,58 @@
+import functools
+import os
+
+import pytest
+
+import data_loader
+import local_s3
+
+
+@pytest.fixture
+def s3_source(monkeypatch):
+    servers = []
+    monkeypatch.setenv('AWS_ACCESS_KEY', 'local')
+    monkeypatch.setenv('AWS_SECRET_KEY', 'local')
+    # retry at once instead of backing off, the stand-in fails a set number of GETs
+    monkeypatch.setattr(data_loader, 'with_retries', functools.partial(data_loader.with_retries, backoff=0))
+
+    def serve(directory, **faults):
+        server, endpoint = local_s3.serve(directory, **faults)
+        servers.append(server)
+        monkeypatch.setenv('GHG_S3_ENDPOINT_URL', endpoint)
+        return data_loader.S3Source('test')
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+
+
+def test_load_table_falls_back_to_the_last_good_snapshot(s3_source, data_dir, tmp_path):
+    snapshot_dir = str(tmp_path / 'snapshot')
+    df, manifest, timing = data_loader.load_table(s3_source(data_dir), 'df_final.csv', snapshot_dir)
+    assert timing['source'] == 'fetched'
+
+    df, _, timing = data_loader.load_table(s3_source(data_dir), 'df_final.csv', snapshot_dir)
+    assert timing['source'] == 'snapshot'
+
+    # the object changes, but every GET of it fails
+    changed = tmp_path / 'changed'
+    changed.mkdir()
+    with open(os.path.join(data_dir, 'df_final.csv'), 'rb') as f:
+        body = f.read()
+    (changed / 'df_final.csv').write_bytes(body + body.splitlines(keepends=True)[-1])
+    source = s3_source(str(changed), fail=data_loader.FETCH_RETRIES + 1)
+    fallback, fallback_manifest, timing = data_loader.load_table(source, 'df_final.csv', snapshot_dir)
+    assert timing['source'] == 'fallback'
+    assert fallback_manifest['source_sha256'] == manifest['source_sha256']
+    assert fallback.equals(df)
+
+    # once the source answers again the change is fetched
+    fetched, _, timing = data_loader.load_table(s3_source(str(changed)), 'df_final.csv', snapshot_dir)
+    assert timing['source'] == 'fetched'
+    assert len(fetched) == len(df) + 1
+
+
+def test_load_table_without_source_or_snapshot_fails(s3_source, data_dir, tmp_path):
+    source = s3_source(data_dir, fail=data_loader.FETCH_RETRIES + 1)
+    with pytest.raises(IOError):
+        data_loader.load_table(source, 'df_final.csv', str(tmp_path / 'snapshot'))
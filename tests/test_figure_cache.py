@@ -0,0 +1,23 @@
+import pytest
+
+import payload
+from figure_cache import FigureCache, MemoryBackend
+
+
+@pytest.mark.parametrize('backend', [None, MemoryBackend(1 << 20)])
+def test_memoize_records_payload_stats_with_any_backend(backend, monkeypatch):
+    monkeypatch.setattr(payload, 'payload_stats', {})
+    cache = FigureCache(backend, data_version=lambda: 'v1')
+    calls = []
+
+    @cache.memoize('figure')
+    def figure(countries):
+        calls.append(countries)
+        return {'data': [{'x': countries, 'y': [1.5] * len(countries)}]}
+
+    assert figure(['USA', 'CHN']) == figure(['CHN', 'USA'])
+    stat = payload.payload_stats['figure']
+    assert stat['count'] == 2
+    assert stat['bytes'] == len('{"data": [{"x": ["CHN", "USA"], "y": [1.5, 1.5]}]}')
+    assert stat['serialize_s'] > 0
+    assert len(calls) == (2 if backend is None else 1)
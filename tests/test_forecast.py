@@ -0,0 +1,37 @@
+import numpy as np
+
+from aggregates import SECTOR_ID_COLUMNS
+from bench_forecast import polyfit_loop
+from forecast import SERIES_KEYS, SIGNED_COLUMNS, forecast_rows
+
+
+def test_forecast_rows_match_polyfit(df_final):
+    columns = [col for col in df_final.columns if col not in SECTOR_ID_COLUMNS]
+    df_actual = df_final[~df_final['predicted']]
+    last_year = int(df_final['Year'].max())
+    future = np.arange(int(df_actual['Year'].max()) + 1, last_year + 1)
+
+    predicted = forecast_rows(df_actual, columns, last_year=last_year, window=0)
+    assert list(predicted.columns) == list(df_final.columns)
+    assert (predicted.dtypes == df_final.dtypes).all()
+    assert predicted['predicted'].all()
+
+    expected = polyfit_loop(df_actual, columns, future, limit=float('inf'))
+    assert len(expected) == df_actual.groupby(SERIES_KEYS, observed=True).ngroups * len(columns)
+    indexed = predicted.set_index(SERIES_KEYS).sort_index()
+    for (country, gas, col), values in expected.items():
+        if col not in SIGNED_COLUMNS:
+            values = np.maximum(values, 0)
+        got = indexed.loc[(country, gas), col].to_numpy(dtype=np.float64)
+        np.testing.assert_allclose(got, values, rtol=1e-9, atol=1e-9 * np.abs(values).max(),
+                                   err_msg=f"{country} {gas} {col}")
+
+
+def test_forecast_window_fits_only_the_last_years(df_final):
+    df_actual = df_final[~df_final['predicted']]
+    series = df_actual[(df_actual['CountryCode'] == 'USA') & (df_actual['Gas'] == 'GHG')]
+    predicted = forecast_rows(series, ['transport'], last_year=2025, window=5)
+    recent = series[series['Year'] > series['Year'].max() - 5]
+    slope, intercept = np.polyfit(recent['Year'].to_numpy(np.float64), recent['transport'].to_numpy(np.float64), 1)
+    np.testing.assert_allclose(predicted['transport'].to_numpy(), np.maximum(slope * predicted['Year'] + intercept, 0),
+                               rtol=1e-9)
@@ -0,0 +1,20 @@
+import os
+
+from static_figures import StaticFigureStore, remove_stale_artifacts
+
+
+def test_remove_stale_artifacts_keeps_the_live_versions(tmp_path):
+    directory = str(tmp_path)
+    old = StaticFigureStore({'area_graphs': dict, 'race-all-allsectors': dict}, data_version='v1', artifact_dir=directory)
+    for name in old.builders:
+        old.get(name)
+    live = StaticFigureStore({'area_graphs': dict}, data_version='v2', artifact_dir=directory)
+    race = StaticFigureStore({'race-all-allsectors': dict}, data_version='v2-race', artifact_dir=directory)
+    live.get('area_graphs')
+    race.get('race-all-allsectors')
+    open(os.path.join(directory, '.precompute.lock'), 'w').close()
+
+    assert remove_stale_artifacts([live, race]) == 2
+    assert sorted(os.listdir(directory)) == sorted(['.precompute.lock', f'area_graphs-{live.version}.json',
+                                                    f'race-all-allsectors-{race.version}.json'])
+    assert remove_stale_artifacts([live, race]) == 0